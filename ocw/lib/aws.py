@@ -0,0 +1,64 @@
+import threading
+import boto3
+from botocore.config import Config
+from webui.PCWConfig import PCWConfig
+
+
+class AWSClients:
+    """
+        boto3 clients and resources shared by all AWS based providers. Clients are thread safe so single client
+        per (namespace, service, region) is shared by all threads. boto3 resources are not thread safe so those
+        are additionally kept per thread. Every client and resource is created from its own session because the
+        default boto3 session can not be used to create clients from several threads at once. Shared clients
+        are created under lock only on cache miss, per thread resources do not need any.
+    """
+    __clients: dict[tuple[str, str, str], object] = {}
+    __resources = threading.local()
+    __lock = threading.Lock()
+
+    @staticmethod
+    def config(namespace: str) -> Config:
+        return Config(
+            max_pool_connections=PCWConfig.get_feature_property('default', 'aws_max_pool_connections', namespace),
+            retries={
+                'mode': PCWConfig.get_feature_property('default', 'aws_retry_mode', namespace),
+                'max_attempts': PCWConfig.get_feature_property('default', 'aws_max_attempts', namespace),
+            },
+            connect_timeout=PCWConfig.get_feature_property('default', 'aws_connect_timeout', namespace),
+            read_timeout=PCWConfig.get_feature_property('default', 'aws_read_timeout', namespace),
+        )
+
+    @staticmethod
+    def __session(key_id: str, secret: str, region: str) -> "boto3.session.Session":
+        return boto3.session.Session(aws_access_key_id=key_id, aws_secret_access_key=secret, region_name=region)
+
+    @staticmethod
+    def client(namespace: str, service: str, region: str, key_id: str, secret: str) -> "boto3.session.Session.client":
+        key = (namespace, service, region)
+        client = AWSClients.__clients.get(key)
+        if client is None:
+            with AWSClients.__lock:
+                # another thread may have created it while this one was waiting for the lock
+                if key not in AWSClients.__clients:
+                    AWSClients.__clients[key] = AWSClients.__session(key_id, secret, region).client(
+                        service, config=AWSClients.config(namespace))
+                client = AWSClients.__clients[key]
+        return client
+
+    @staticmethod
+    def resource(namespace: str, service: str, region: str, key_id: str, secret: str) -> "boto3.session.Session.resource":
+        resources = getattr(AWSClients.__resources, 'cache', None)
+        if resources is None:
+            resources = AWSClients.__resources.cache = {}
+        key = (namespace, service, region)
+        if key not in resources:
+            # resource is used only by current thread so it is built without holding the lock
+            resources[key] = AWSClients.__session(key_id, secret, region).resource(
+                service, config=AWSClients.config(namespace))
+        return resources[key]
+
+    @staticmethod
+    def clear() -> None:
+        with AWSClients.__lock:
+            AWSClients.__clients.clear()
+            AWSClients.__resources = threading.local()
@@ -1,34 +1,167 @@
+import os
+import threading
 import time
-from typing import Dict
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.exceptions import ClientAuthenticationError
+from azure.core.pipeline.transport import RequestsTransport  # pylint: disable=no-name-in-module
 from azure.identity import ClientSecretCredential
 from azure.mgmt.resource import ResourceManagementClient
 from azure.mgmt.compute import ComputeManagementClient
 from azure.mgmt.storage import StorageManagementClient
 from azure.storage.blob import BlobServiceClient
-from azure.core.exceptions import ResourceNotFoundError
 from msrest.exceptions import AuthenticationError
-from dateutil.parser import parse
+from django.db import connections
 from webui.PCWConfig import PCWConfig
+from .influx import Influx
 from .provider import Provider
-from ..models import Instance
+from ..models import Instance, ProviderChoice, StateChoice, format_seconds
+
+
+class AzureDeletions:
+    """
+        Tracks pollers of long running delete operations started via begin_delete. At most
+        default/azure_max_inflight_deletes deletions are in flight, further ones are queued and started
+        by background thread once some running deletion finishes (or refused when caller can't have them
+        queued), so callers are never blocked.
+        Completion is checked every default/azure_lro_poll_interval seconds, thread lives only while
+        there is something to poll or start.
+    """
+
+    def __init__(self, azure: "Azure", namespace: str):
+        self.__azure = azure
+        self.__namespace = namespace
+        self.__lock = threading.Lock()
+        self.__queue: deque = deque()
+        self.__pending: dict = {}
+        self.__thread: threading.Thread | None = None
+
+    def __free_slots(self) -> int:
+        return PCWConfig.get_feature_property('default', 'azure_max_inflight_deletes', self.__namespace) - len(self.__pending)
+
+    def submit(self, name: str, begin_delete: Callable, *args, on_done: Callable | None = None, queue: bool = True) -> bool:
+        """
+            Start deletion of resource called `name` via `begin_delete(*args)`, `on_done` is called once Azure confirms it.
+            When there is free slot deletion is started right away and errors are raised to the caller,
+            otherwise it is queued (errors of the delayed start are only logged) or refused when `queue` is False
+            :return: True when begin_delete was called, False when deletion was queued or refused
+        """
+        with self.__lock:
+            start_now = not self.__queue and self.__free_slots() > 0
+            if not start_now:
+                if not queue:
+                    self.__azure.log_dbg(f"Deletion of {name} refused, {len(self.__pending)} deletions in flight")
+                    return False
+                self.__queue.append((name, begin_delete, args, on_done))
+                self.__azure.log_dbg(f"Deletion of {name} queued, {len(self.__pending)} deletions in flight")
+                self.__ensure_thread()
+                return False
+        self.__start(name, begin_delete(*args), on_done)
+        return True
+
+    def __start(self, name: str, poller, on_done: Callable | None) -> None:
+        with self.__lock:
+            self.__pending[poller] = (name, time.monotonic(), on_done)
+            self.__ensure_thread()
+
+    def __ensure_thread(self) -> None:
+        # expects self.__lock to be held
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, name='azure-deletions', daemon=True)
+            self.__thread.start()
+
+    def pending(self) -> int:
+        """ Amount of deletions which are in flight or queued """
+        with self.__lock:
+            return len(self.__pending) + len(self.__queue)
+
+    def queued(self) -> int:
+        """ Amount of deletions which were not started yet """
+        with self.__lock:
+            return len(self.__queue)
+
+    def wait(self, timeout: float | None = None) -> None:
+        """ Block until all tracked deletions are finished or timeout (in seconds) expires """
+        with self.__lock:
+            thread = self.__thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def poll(self) -> None:
+        """ Handle finished deletions and start queued ones for which slot got free """
+        with self.__lock:
+            pending = list(self.__pending.items())
+        for poller, (name, started, on_done) in pending:
+            try:
+                if not poller.done():
+                    continue
+                poller.result()
+            except Exception as exc:
+                self.__azure.log_err(f"Deletion of {name} failed: {exc}")
+                self.__finish(poller)
+                continue
+            self.__finish(poller)
+            latency = time.monotonic() - started
+            self.__azure.log_info(f"Deletion of {name} finished after {format_seconds(latency)}")
+            if os.getenv("INFLUX_TOKEN") is not None:
+                Influx().write(ProviderChoice.AZURE.value, Influx.DELETION_LATENCY, int(latency), self.__namespace)
+            if on_done is not None:
+                try:
+                    on_done()
+                except Exception as exc:
+                    self.__azure.log_err(f"Handling of finished deletion of {name} failed: {exc}")
+        self.__start_queued()
+
+    def __start_queued(self) -> None:
+        while True:
+            with self.__lock:
+                if not self.__queue or self.__free_slots() <= 0:
+                    return
+                name, begin_delete, args, on_done = self.__queue.popleft()
+            try:
+                self.__start(name, begin_delete(*args), on_done)
+            except Exception as exc:
+                self.__azure.log_err(f"Deletion of {name} failed to start: {exc}")
+
+    def __finish(self, poller) -> None:
+        with self.__lock:
+            del self.__pending[poller]
+
+    def __run(self) -> None:
+        try:
+            while True:
+                self.poll()
+                with self.__lock:
+                    if not self.__pending and not self.__queue:
+                        self.__thread = None
+                        return
+                time.sleep(PCWConfig.get_feature_property('default', 'azure_lro_poll_interval', self.__namespace))
+        finally:
+            # thread may touch DB in on_done callbacks
+            connections.close_all()
 
 
 class Azure(Provider):
     __instances: Dict[str, "Azure"] = {}
+    # maximal amount of blobs which can be deleted with single batch request
+    BLOB_BATCH_SIZE: int = 256
 
     def __init__(self, namespace: str):
         super().__init__(namespace)
         self.__resource_group: str = str(PCWConfig.get_feature_property('cleanup', 'azure-storage-resourcegroup', namespace))
-        self.check_credentials()
+        self.ensure_credentials(self.check_credentials)
         self.__gallery: str = str(PCWConfig.get_feature_property('cleanup', 'azure-gallery-name', namespace))
 
     def __new__(cls, namespace: str) -> 'Azure':
         if namespace not in Azure.__instances:
             Azure.__instances[namespace] = self = object.__new__(cls)
-            self.__compute_mgmt_client = None
-            self.__sp_credentials = None
-            self.__resource_mgmt_client = None
-            self.__blob_service_client = None
+            self.__clients = {}
+            # reentrant because creation of client needs credential which is created under same lock
+            self.__clients_lock = threading.RLock()
+            self.deletions = AzureDeletions(self, namespace)
         return Azure.__instances[namespace]
 
     def subscription(self) -> str:
@@ -37,77 +170,122 @@ class Azure(Provider):
     def check_credentials(self) -> bool:
         for i in range(1, 5):
             try:
-                self.list_resource_groups()
+                # single resource group is enough to prove that credentials are valid
+                next(iter(self.resource_mgmt_client().resource_groups.list(top=1)), None)
                 return True
-            except AuthenticationError:
+            except (AuthenticationError, ClientAuthenticationError):
                 self.log_info(f"Check credentials failed (attempt:{i}) - client_id {self.get_data('client_id')}")
                 time.sleep(1)
         raise AuthenticationError("Invalid Azure credentials")
 
+    def __shared(self, name: str, factory: Callable):
+        """ Create client on first use. Clients are thread safe so all threads share the same one """
+        with self.__clients_lock:
+            if name not in self.__clients:
+                self.__clients[name] = factory()
+            return self.__clients[name]
+
+    def transport(self) -> RequestsTransport:
+        """ HTTP transport with connection pool big enough for all threads working with Azure in parallel """
+        def create_session() -> requests.Session:
+            pool_size = PCWConfig.get_feature_property('default', 'azure_max_pool_connections', self._namespace)
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+            return session
+        # session is shared by all clients so kept alive connections are reused by all of them
+        return RequestsTransport(
+            session=self.__shared('session', create_session), session_owner=False,
+            connection_timeout=PCWConfig.get_feature_property('default', 'azure_connect_timeout', self._namespace),
+            read_timeout=PCWConfig.get_feature_property('default', 'azure_read_timeout', self._namespace),
+        )
+
     def bs_client(self):
-        if self.__blob_service_client is None:
+        def create():
             storage_account = PCWConfig.get_feature_property(
                 'cleanup', 'azure-storage-account-name', self._namespace)
             storage_key = self.get_storage_key(storage_account)
-            self.__blob_service_client = BlobServiceClient.from_connection_string(
-                f"DefaultEndpointsProtocol=https;AccountName={storage_account};AccountKey={storage_key};EndpointSuffix=core.windows.net"
+            return BlobServiceClient.from_connection_string(
+                f"DefaultEndpointsProtocol=https;AccountName={storage_account};AccountKey={storage_key};EndpointSuffix=core.windows.net",
+                transport=self.transport()
             )
-        return self.__blob_service_client
+        return self.__shared('blob', create)
 
     def container_client(self, container_name: str):
         return self.bs_client().get_container_client(container_name)
 
     def sp_credentials(self):
-        if self.__sp_credentials is None:
-            self.__sp_credentials = ClientSecretCredential(client_id=self.get_data(
-                'client_id'), client_secret=self.get_data('client_secret'), tenant_id=self.get_data('tenant_id'))
-        return self.__sp_credentials
+        # credential keeps acquired token in memory and refreshes it only shortly before it expires
+        return self.__shared('credential', lambda: ClientSecretCredential(
+            client_id=self.get_data('client_id'), client_secret=self.get_data('client_secret'),
+            tenant_id=self.get_data('tenant_id'), transport=self.transport()))
 
     def compute_mgmt_client(self):
-        if self.__compute_mgmt_client is None:
-            self.__compute_mgmt_client = ComputeManagementClient(
-                self.sp_credentials(), self.subscription())
-        return self.__compute_mgmt_client
+        return self.__shared('compute', lambda: ComputeManagementClient(
+            self.sp_credentials(), self.subscription(), transport=self.transport()))
 
     def resource_mgmt_client(self):
-        if self.__resource_mgmt_client is None:
-            self.__resource_mgmt_client = ResourceManagementClient(
-                self.sp_credentials(), self.subscription())
-        return self.__resource_mgmt_client
+        return self.__shared('resource', lambda: ResourceManagementClient(
+            self.sp_credentials(), self.subscription(), transport=self.transport()))
+
+    def storage_mgmt_client(self):
+        return self.__shared('storage', lambda: StorageManagementClient(
+            self.sp_credentials(), self.subscription(), transport=self.transport()))
 
     def get_storage_key(self, storage_account: str) -> str:
-        storage_client = StorageManagementClient(self.sp_credentials(), self.subscription())
-        storage_keys = storage_client.storage_accounts.list_keys(self.__resource_group, storage_account)
+        storage_keys = self.storage_mgmt_client().storage_accounts.list_keys(self.__resource_group, storage_account)
         storage_keys = [v.value for v in storage_keys.keys]
         return storage_keys[0]
 
     def list_instances(self) -> list:
         return list(self.compute_mgmt_client().virtual_machines.list_all())
 
-    def get_vm_types_in_resource_group(self, resource_group: str) -> str | None:
-        self.log_dbg(f"Listing VMs for {resource_group}")
-        type_set = set()
-        try:
-            vms = self.compute_mgmt_client().virtual_machines.list(resource_group)
-            for azure_vm in vms:
-                type_set.add(azure_vm.hardware_profile.vm_size)
-        except ResourceNotFoundError:
-            self.log_dbg(f"{resource_group} already deleted")
+    def get_vm_types_by_resource_group(self) -> dict[str, str]:
+        """ Map lower cased resource group name to VM sizes running inside it using single list_all call """
+        type_sets: dict[str, set] = {}
+        for azure_vm in self.list_instances():
+            # /subscriptions/{subscription}/resourceGroups/{resource group}/providers/...
+            resource_group = azure_vm.id.split('/')[4].lower()
+            type_sets.setdefault(resource_group, set()).add(azure_vm.hardware_profile.vm_size)
+        return {resource_group: ', '.join(types) for resource_group, types in type_sets.items()}
+
+    @staticmethod
+    def get_vm_types_in_resource_group(resource_group, vm_types: dict[str, str]) -> str | None:
+        """
+            Resolve VM types of resource group from index built by get_vm_types_by_resource_group.
+            Group which is already in "Deleting" state is treated as already deleted and None is returned
+        """
+        if resource_group.properties is not None and resource_group.properties.provisioning_state == 'Deleting':
             return None
-        return ', '.join(type_set) if type_set else "N/A"
+        return vm_types.get(resource_group.name.lower(), "N/A")
 
     def get_resource_properties(self, resource_id):
         return self.resource_mgmt_client().resources.get_by_id(resource_id, api_version="2023-07-03").properties
 
-    def list_resource_groups(self) -> list:
-        return list(self.resource_mgmt_client().resource_groups.list())
-
-    def delete_resource(self, resource_id: str) -> None:
+    def iter_resource_groups(self) -> Iterator:
+        """
+            Stream resource groups page by page. Optional default/azure_resource_group_filter is passed
+            as $filter so Azure itself drops groups PCW is not interested in (e.g. "tagName eq 'openqa_created_by'")
+        """
+        resource_group_filter = PCWConfig.get_feature_property('default', 'azure_resource_group_filter', self._namespace)
+        return iter(self.resource_mgmt_client().resource_groups.list(filter=resource_group_filter or None))
+
+    def delete_resource(self, resource_id: str) -> bool:
+        """
+            Start deletion of resource group. It is never queued because caller marks the instance as DELETING,
+            when too many deletions are in flight it is left to next update run instead
+            :return: False when deletion was not started because of default/azure_max_inflight_deletes
+        """
         if self.dry_run:
             self.log_info(f"Deletion of resource group {resource_id} skipped due to dry run mode")
-        else:
-            self.log_info(f"Deleting of resource group {resource_id}")
-            self.resource_mgmt_client().resource_groups.begin_delete(resource_id)
+            return True
+        self.log_info(f"Deleting of resource group {resource_id}")
+        return self.deletions.submit(f"resource group {resource_id}", self.resource_mgmt_client().resource_groups.begin_delete,
+                                     resource_id, on_done=lambda: self.mark_deleted(resource_id), queue=False)
+
+    def mark_deleted(self, resource_group: str) -> None:
+        """ Resource group deletion was confirmed by Azure so there is no need to wait for next update run """
+        Instance.objects.filter(provider=ProviderChoice.AZURE, namespace=self._namespace, instance_id=resource_group) \
+            .exclude(state=StateChoice.DELETED).update(state=StateChoice.DELETED)
 
     def list_images(self):
         return self.list_resource(filters="resourceType eq 'Microsoft.Compute/images'")
@@ -116,7 +294,8 @@ class Azure(Provider):
         return self.unscoped_list_resource(filters="resourceType eq 'Microsoft.Compute/images'")
 
     def list_disks(self):
-        return self.list_resource(filters="resourceType eq 'Microsoft.Compute/disks'")
+        """ Disk models returned by compute API already contain managed_by and time_created """
+        return self.compute_mgmt_client().disks.list_by_resource_group(self.__resource_group)
 
     def report_list_disks(self):
         return self.unscoped_list_resource(filters="resourceType eq 'Microsoft.Compute/disks'")
@@ -136,6 +315,27 @@ class Azure(Provider):
         self.cleanup_disks()
         self.cleanup_blob_containers()
 
+    @staticmethod
+    def wait_for_all_deletions() -> None:
+        """
+            PCW commands run as short living processes so deletions started in all namespaces are awaited (at most
+            default/azure_lro_wait_timeout seconds) to not lose their completion handling. Deletions of all namespaces
+            run concurrently so timeouts of all namespaces count from the same start
+        """
+        started = time.monotonic()
+        for namespace, azure in list(Azure.__instances.items()):
+            timeout = PCWConfig.get_feature_property('default', 'azure_lro_wait_timeout', namespace)
+            azure.wait_for_deletions(max(0.0, timeout - (time.monotonic() - started)))
+
+    def wait_for_deletions(self, timeout: float) -> None:
+        self.deletions.wait(timeout)
+        queued = self.deletions.queued()
+        unfinished = self.deletions.pending() - queued
+        if queued:
+            self.log_warn(f"{queued} deletions were never started, next cleanup run will issue them again")
+        if unfinished:
+            self.log_warn(f"{unfinished} deletions did not finish in time, their completion will not be tracked")
+
     @staticmethod
     def container_valid_for_cleanup(container) -> bool:
         '''
@@ -156,18 +356,43 @@ class Azure(Provider):
 
     def cleanup_blob_containers(self) -> None:
         self.log_dbg("Call cleanup_blob_containers")
-        containers = self.bs_client().list_containers(include_metadata=True)
-        for container in containers:
-            if Azure.container_valid_for_cleanup(container):
-                self.log_dbg(f'Found container {container.name}')
-                container_blobs = self.container_client(container.name).list_blobs()
-                for blob in container_blobs:
-                    if self.is_outdated(blob.last_modified):
-                        if self.dry_run:
-                            self.log_info(f"Deletion of blob {blob.name} skipped due to dry run mode")
-                        else:
-                            self.log_info(f"Deleting blob {blob.name}")
-                            self.container_client(container.name).delete_blob(blob.name, delete_snapshots="include")
+        containers = [c.name for c in self.bs_client().list_containers(include_metadata=True) if Azure.container_valid_for_cleanup(c)]
+        max_workers = PCWConfig.get_feature_property('cleanup', 'azure-blob-max-workers', self._namespace)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='azure-blobs') as executor:
+            for task in [executor.submit(self.cleanup_blob_container, name) for name in containers]:
+                task.result()
+
+    def cleanup_blob_container(self, container_name: str) -> None:
+        """ Stream blobs of the container and delete the outdated ones in batches of up to BLOB_BATCH_SIZE.
+        Failed deletions don't stop remaining batches and are raised together once all batches are done """
+        self.log_dbg(f'Found container {container_name}')
+        container_client = self.container_client(container_name)
+        outdated = []
+        failures = []
+        for blob in container_client.list_blobs():
+            if self.is_outdated(blob.last_modified):
+                if self.dry_run:
+                    self.log_info(f"Deletion of blob {blob.name} skipped due to dry run mode")
+                    continue
+                outdated.append(blob.name)
+                if len(outdated) == Azure.BLOB_BATCH_SIZE:
+                    failures.extend(self.delete_blobs(container_client, outdated))
+                    outdated = []
+        if outdated:
+            failures.extend(self.delete_blobs(container_client, outdated))
+        if failures:
+            raise RuntimeError(f"Deletion of {len(failures)} blobs in container {container_name} failed: {', '.join(failures)}")
+
+    def delete_blobs(self, container_client, blob_names: list[str]) -> list[str]:
+        """ Delete blobs in one batch request and return descriptions of failed deletions """
+        self.log_info(f"Deleting blobs {', '.join(blob_names)}")
+        responses = container_client.delete_blobs(*blob_names, delete_snapshots="include", raise_on_any_failure=False)
+        failures = []
+        for blob_name, response in zip(blob_names, responses):
+            # 404 means that blob was already deleted meanwhile
+            if response.status_code not in (202, 404):
+                failures.append(f"{blob_name} ({response.status_code} {response.reason})")
+        return failures
 
     def cleanup_images(self) -> None:
         self.log_dbg("Call cleanup_images")
@@ -177,20 +402,22 @@ class Azure(Provider):
                     self.log_info(f"Deletion of image {item.name} skipped due to dry run mode")
                 else:
                     self.log_info(f"Delete image '{item.name}'")
-                    self.compute_mgmt_client().images.begin_delete(self.__resource_group, item.name)
+                    self.deletions.submit(f"image {item.name}", self.compute_mgmt_client().images.begin_delete,
+                                          self.__resource_group, item.name)
 
     def cleanup_disks(self) -> None:
         self.log_dbg("Call cleanup_disks")
-        for item in self.list_disks():
-            if self.is_outdated(item.changed_time):
-                if self.compute_mgmt_client().disks.get(self.__resource_group, item.name).managed_by:
-                    self.log_warn(f"Disk is in use - skipping {item.name}")
-                else:
-                    if self.dry_run:
-                        self.log_info(f"Deletion of disk {item.name} skipped due to dry run mode")
-                    else:
-                        self.log_info(f"Delete disk '{item.name}'")
-                        self.compute_mgmt_client().disks.begin_delete(self.__resource_group, item.name)
+        for disk in self.list_disks():
+            if not self.is_outdated(disk.time_created):
+                continue
+            if disk.managed_by:
+                self.log_warn(f"Disk is in use - skipping {disk.name}")
+            elif self.dry_run:
+                self.log_info(f"Deletion of disk {disk.name} skipped due to dry run mode")
+            else:
+                self.log_info(f"Delete disk '{disk.name}'")
+                self.deletions.submit(f"disk {disk.name}", self.compute_mgmt_client().disks.begin_delete,
+                                      self.__resource_group, disk.name)
 
     def cleanup_gallery_img_versions(self) -> None:
         self.log_dbg("Call cleanup_gallery_img_versions")
@@ -198,57 +425,96 @@ class Azure(Provider):
         if Instance.TAG_IGNORE in gallery.tags:
             self.log_err(f"Gallery in resource group {self.__resource_group} has {Instance.TAG_IGNORE} tag: {self.__gallery}")
             return
-        for image in self.compute_mgmt_client().gallery_images.list_by_gallery(self.__resource_group, gallery.name):
-            if Instance.TAG_IGNORE in image.tags:
-                self.log_info(f"Gallery {self.__gallery} image {image} has {Instance.TAG_IGNORE} tag")
+        max_workers = PCWConfig.get_feature_property('cleanup', 'azure-gallery-max-workers', self._namespace)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='azure-gallery') as executor:
+            tasks = [executor.submit(self.cleanup_gallery_image, gallery.name, image)
+                     for image in self.compute_mgmt_client().gallery_images.list_by_gallery(self.__resource_group, gallery.name)]
+            for task in tasks:
+                task.result()
+
+    def cleanup_gallery_image(self, gallery_name: str, image) -> None:
+        if Instance.TAG_IGNORE in image.tags:
+            self.log_info(f"Gallery {gallery_name} image {image} has {Instance.TAG_IGNORE} tag")
+            return
+        versions_count = 0
+        for version in self.compute_mgmt_client().gallery_image_versions.list_by_gallery_image(
+                self.__resource_group, gallery_name, image.name):
+            versions_count += 1
+            if version.tags is not None and Instance.TAG_IGNORE in version.tags:
+                self.log_info(f"Image version {version} for image {image} in gallery {gallery_name} has {Instance.TAG_IGNORE} tag")
                 continue
-            versions = list(self.compute_mgmt_client().gallery_image_versions.list_by_gallery_image(
-                self.__resource_group, gallery.name, image.name))
-            self.log_dbg(f"Image {image} in gallery {self.__gallery} has {len(versions)} versions")
-            for version in versions:
-                if version.tags is not None and Instance.TAG_IGNORE in version.tags:
-                    self.log_info(f"Image version {version} for image {image} in gallery {self.__gallery} has {Instance.TAG_IGNORE} tag")
-                    continue
-                if version.provisioning_state == "Failed" or \
-                        self.is_outdated(parse(self.get_resource_properties(version.id)['publishingProfile']['publishedDate'])):
-                    if self.dry_run:
-                        self.log_info(f"Deletion of version {gallery.name}/{image.name}/{version.name} skipped due to dry run mode")
-                    else:
-                        self.log_info(f"Delete version '{gallery.name}/{image.name}/{version.name}'")
-                        self.compute_mgmt_client().gallery_image_versions.begin_delete(
-                                self.__resource_group, gallery.name, image.name, version.name
-                        )
-            # Delete image definition if all image versions were deleted
-            if not versions:
+            # publishing_profile of versions returned by listing already contains published date
+            published_date = version.publishing_profile.published_date if version.publishing_profile else None
+            if version.provisioning_state == "Failed" or (published_date is not None and self.is_outdated(published_date)):
                 if self.dry_run:
-                    self.log_info(f"Deletion of image {gallery.name}/{image.name} skipped due to dry run mode")
+                    self.log_info(f"Deletion of version {gallery_name}/{image.name}/{version.name} skipped due to dry run mode")
                 else:
-                    self.log_info(f"Delete image '{gallery.name}/{image.name}'")
-                    self.compute_mgmt_client().gallery_images.begin_delete(
-                            self.__resource_group, gallery.name, image.name
-                    )
+                    self.log_info(f"Delete version '{gallery_name}/{image.name}/{version.name}'")
+                    self.deletions.submit(f"version {gallery_name}/{image.name}/{version.name}",
+                                          self.compute_mgmt_client().gallery_image_versions.begin_delete,
+                                          self.__resource_group, gallery_name, image.name, version.name)
+        self.log_dbg(f"Image {image} in gallery {gallery_name} has {versions_count} versions")
+        # Delete image definition if all image versions were deleted
+        if versions_count == 0:
+            if self.dry_run:
+                self.log_info(f"Deletion of image {gallery_name}/{image.name} skipped due to dry run mode")
+            else:
+                self.log_info(f"Delete image '{gallery_name}/{image.name}'")
+                self.deletions.submit(f"image {gallery_name}/{image.name}",
+                                      self.compute_mgmt_client().gallery_images.begin_delete,
+                                      self.__resource_group, gallery_name, image.name)
 
     def get_img_versions_count(self) -> int:
         self.log_dbg("Call get_img_versions_count")
+        counts = self.count_gallery_img_versions()
+        for gallery, count in counts.items():
+            self.log_dbg(f"Gallery {gallery} has {count} image versions")
+        return sum(counts.values())
+
+    def count_gallery_img_versions(self) -> dict[str, int]:
+        """
+            Count image versions of all galleries in subscription. Galleries are found with single subscription wide
+            listing, then image definitions of all galleries are listed concurrently and finally versions of all
+            image definitions are counted concurrently without materializing them
+            :return: dict mapping "{resource group}/{gallery}" to amount of image versions in it
+        """
+        counts: dict[str, int] = {}
+        max_workers = PCWConfig.get_feature_property('cleanup', 'azure-gallery-max-workers', self._namespace)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='azure-gallery') as executor:
+            listings = {}
+            for gallery in self.compute_mgmt_client().galleries.list():
+                # /subscriptions/{subscription}/resourceGroups/{resource group}/providers/...
+                resource_group = gallery.id.split('/')[4]
+                listings[(resource_group, gallery.name)] = executor.submit(self.list_gallery_images, resource_group, gallery.name)
+            versions = {gallery: self.submit_version_counts(executor, gallery, listing) for gallery, listing in listings.items()}
+            for (resource_group, gallery_name), tasks in versions.items():
+                count = self.sum_version_counts(resource_group, gallery_name, tasks)
+                if count is not None:
+                    counts[f"{resource_group}/{gallery_name}"] = count
+        return counts
+
+    def list_gallery_images(self, resource_group: str, gallery_name: str) -> list[str]:
+        return [image.name for image in self.compute_mgmt_client().gallery_images.list_by_gallery(resource_group, gallery_name)]
+
+    def submit_version_counts(self, executor: ThreadPoolExecutor, gallery: tuple[str, str], listing: Future) -> list[Future] | None:
+        """ Submit version count of every image definition of the gallery once its listing is done.
+        :return: tasks counting versions or None when image definitions could not be listed
+        """
+        try:
+            return [executor.submit(self.count_image_versions, *gallery, image_name) for image_name in listing.result()]
+        except Exception as e:
+            self.log_err(f"Skipping gallery {gallery[1]} in resource group {gallery[0]} due to error: {e}")
+            return None
 
-        compute_client = self.compute_mgmt_client()
-        resource_client = self.resource_mgmt_client()  # You need to have this method or client setup
-
-        total_versions = 0
+    def sum_version_counts(self, resource_group: str, gallery_name: str, tasks: list[Future] | None) -> int | None:
+        if tasks is None:
+            return None
+        try:
+            return sum(task.result() for task in tasks)
+        except Exception as e:
+            self.log_err(f"Skipping gallery {gallery_name} in resource group {resource_group} due to error: {e}")
+            return None
 
-        for rg in resource_client.resource_groups.list():
-            rg_name = rg.name
-            try:
-                galleries = compute_client.galleries.list_by_resource_group(rg_name)
-                for gallery in galleries:
-                    images = compute_client.gallery_images.list_by_gallery(rg_name, gallery.name)
-                    for image in images:
-                        versions = list(compute_client.gallery_image_versions.list_by_gallery_image(
-                            rg_name, gallery.name, image.name
-                        ))
-                        version_count = len(versions)
-                        total_versions += version_count
-            except Exception as e:
-                self.log_err(f"Skipping resource group {rg_name} due to error: {e}")
-
-        return total_versions
+    def count_image_versions(self, resource_group: str, gallery_name: str, image_name: str) -> int:
+        return sum(1 for _ in self.compute_mgmt_client().gallery_image_versions.list_by_gallery_image(
+            resource_group, gallery_name, image_name))
@@ -1,10 +1,13 @@
 import json
+import threading
 import traceback
 import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from os.path import basename
 from datetime import datetime, timedelta, timezone
 import dateutil.parser as dateparser
-from django.db import transaction
+from django.db import transaction, connections
 from ocw.apps import getScheduler
 from webui.PCWConfig import PCWConfig
 from ..models import Instance, StateChoice, ProviderChoice, CspInfo, format_seconds
@@ -16,61 +19,80 @@ from .gce import GCE
 logger = logging.getLogger(__name__)
 RUNNING = False
 LAST_UPDATE = None
+# SQLite allows only one writer, so provider syncs running in parallel are serialized on the write phase
+SYNC_LOCK = threading.Lock()
 
 
-@transaction.atomic
-def save_or_update_instance(csp_data: dict) -> None:
-    provider = csp_data['provider']
-    namespace = csp_data['namespace']
-    if Instance.objects.filter(provider=provider, instance_id=csp_data['id'], namespace=namespace).exists():
-        logger.debug("[%s] Update instance %s:%s", namespace, provider, csp_data['id'])
-        local_instance = Instance.objects.get(provider=provider, instance_id=csp_data['id'], namespace=namespace)
-        if local_instance.region != csp_data['region']:
-            logger.info("[%s] Instance %s:%s changed region from %s to %s", namespace,
-                        provider, csp_data['id'], local_instance.region, csp_data['region'])
-            local_instance.region = csp_data['region']
-        if local_instance.state == StateChoice.DELETED:
-            logger.info("[%s] %s:%s instance which still exists has DELETED state in DB.",
-                        namespace, provider, csp_data['id'])
-            local_instance.first_seen = csp_data['first_seen']
-        local_instance.cspinfo.tags = json.dumps(csp_data['tags'])
-    else:
-        logger.debug("[%s] Create instance %s:%s", namespace, provider, csp_data['id'])
-        local_instance = Instance(
-            provider=provider,
-            namespace=namespace,
-            first_seen=csp_data['first_seen'],
-            instance_id=csp_data['id'],
-            ttl=timedelta(seconds=int(csp_data['tags'].get('openqa_ttl', csp_data['default_ttl']))),
-            region=csp_data['region']
-        )
-        CspInfo(tags=json.dumps(csp_data['tags']), type=csp_data['type'], instance=local_instance)
-    # Azure has exceptional case when it is querying entity second time
-    # because it is only way to get VM type(s) which is running inside resource group
-    # it might happen that in such case we discovering that resource group already deleted
-    # which means that set_alive() must be skipped
-    if provider == ProviderChoice.AZURE and local_instance.cspinfo.type is None:
-        logger.debug("[%s] Azure group %s already deleted", namespace, local_instance.instance_id)
-    else:
-        local_instance.set_alive()
-        local_instance.save()
-        local_instance.cspinfo.save()
-
-
-def ec2_extract_data(csp_instance, namespace: str, region: str, default_ttl: int) -> dict:
+def sync_instances(provider: str, namespace: str, csp_instances: list[dict]) -> None:
+    '''
+    Reconcile all Instance/CspInfo rows of certain provider and namespace with data freshly listed from CSP.
+    Existing rows are loaded with a single query and changes are written back via bulk operations
+    within one transaction, so amount of queries does not grow with amount of instances.
+    '''
+    with SYNC_LOCK, transaction.atomic():
+        local_instances = {i.instance_id: i for i in Instance.objects.filter(
+            provider=provider, namespace=namespace).select_related('cspinfo')}
+        alive = {}
+        for csp_data in csp_instances:
+            local_instance = local_instances.get(csp_data['id'])
+            if local_instance is not None:
+                logger.debug("[%s] Update instance %s:%s", namespace, provider, csp_data['id'])
+                if local_instance.region != csp_data['region']:
+                    logger.info("[%s] Instance %s:%s changed region from %s to %s", namespace,
+                                provider, csp_data['id'], local_instance.region, csp_data['region'])
+                    local_instance.region = csp_data['region']
+                if local_instance.state == StateChoice.DELETED:
+                    logger.info("[%s] %s:%s instance which still exists has DELETED state in DB.",
+                                namespace, provider, csp_data['id'])
+                    local_instance.first_seen = csp_data['first_seen']
+                local_instance.cspinfo.tags = json.dumps(csp_data['tags'])
+            else:
+                logger.debug("[%s] Create instance %s:%s", namespace, provider, csp_data['id'])
+                local_instance = Instance(
+                    provider=provider,
+                    namespace=namespace,
+                    first_seen=csp_data['first_seen'],
+                    instance_id=csp_data['id'],
+                    ttl=timedelta(seconds=int(csp_data['tags'].get('openqa_ttl', csp_data['default_ttl']))),
+                    region=csp_data['region']
+                )
+                CspInfo(tags=json.dumps(csp_data['tags']), type=csp_data['type'], instance=local_instance)
+                local_instances[csp_data['id']] = local_instance
+            # Azure has exceptional case when resource group is listed but already being deleted
+            # (see Azure.get_vm_types_in_resource_group) which means that set_alive() must be skipped
+            if provider == ProviderChoice.AZURE and local_instance.cspinfo.type is None:
+                logger.debug("[%s] Azure group %s already deleted", namespace, local_instance.instance_id)
+            else:
+                local_instance.set_alive()
+                alive[local_instance.instance_id] = local_instance
+
+        created = [i for i in alive.values() if i.pk is None]
+        updated = [i for i in alive.values() if i.pk is not None]
+        instance_cnt = Instance.objects.filter(provider=provider, namespace=namespace).update(active=False)
+        logger.debug("%d got active state false", instance_cnt)
+        Instance.objects.bulk_create(created)
+        CspInfo.objects.bulk_create([i.cspinfo for i in created])
+        Instance.objects.bulk_update(updated, ['region', 'first_seen', 'last_seen', 'active', 'age', 'state', 'ignore'])
+        CspInfo.objects.bulk_update([i.cspinfo for i in updated], ['tags'])
+        Instance.objects.filter(provider=provider, namespace=namespace,
+                                active=False).update(state=StateChoice.DELETED)
+        logger.debug("[%s] %d instances created and %d updated for %s", namespace, len(created), len(updated), provider)
+
+
+def ec2_extract_data(csp_instance: dict, namespace: str, region: str, default_ttl: int) -> dict:
     return {
-        'tags': {t['Key']: t['Value'] for t in csp_instance.tags} if csp_instance.tags else {},
-        'id': csp_instance.instance_id,
-        'first_seen': dateparser.parse(csp_instance.launch_time.isoformat()),
+        'tags': {t['Key']: t['Value'] for t in csp_instance['Tags']},
+        'id': csp_instance['InstanceId'],
+        'first_seen': dateparser.parse(csp_instance['LaunchTime'].isoformat()),
         'namespace': namespace,
         'region': region,
         'provider': ProviderChoice.EC2,
-        'type': csp_instance.instance_type,
+        'type': csp_instance['InstanceType'],
         'default_ttl': default_ttl
     }
 
 
-def azure_extract_data(csp_instance, namespace: str, default_ttl: int) -> dict:
+def azure_extract_data(csp_instance, namespace: str, default_ttl: int, vm_types: dict[str, str]) -> dict:
     if csp_instance.tags:
         tags = csp_instance.tags
         first_seen = dateparser.parse(tags.get('openqa_created_date', str(datetime.now(tz=timezone.utc))))
@@ -84,7 +106,7 @@ def azure_extract_data(csp_instance, namespace: str, default_ttl: int) -> dict:
         'namespace': namespace,
         'region': csp_instance.location,
         'provider': ProviderChoice.AZURE,
-        'type': Azure(namespace).get_vm_types_in_resource_group(csp_instance.name),
+        'type': Azure.get_vm_types_in_resource_group(csp_instance, vm_types),
         'default_ttl': default_ttl
     }
 
@@ -107,30 +129,31 @@ def gce_extract_data(csp_instance, namespace: str, default_ttl: int) -> dict:
 
 
 def _update_provider(provider: str, namespace: str, default_ttl: int) -> None:
-    instance_cnt = Instance.objects.filter(provider=provider, namespace=namespace).update(active=False)
-    logger.debug("%d got active state false", instance_cnt)
+    csp_instances = []
     if ProviderChoice.from_str(provider) == ProviderChoice.AZURE:
-        instances = Azure(namespace).list_resource_groups()
-        for i in instances:
-            save_or_update_instance(azure_extract_data(i, namespace, default_ttl))
-        logger.info("%d resources groups from Azure succesfully processed", len(instances))
+        # VMs are listed before groups so a group deleted in between is simply missing in the listing
+        vm_types = Azure(namespace).get_vm_types_by_resource_group()
+        csp_instances.extend(azure_extract_data(i, namespace, default_ttl, vm_types) for i in Azure(namespace).iter_resource_groups())
+        logger.info("%d resources groups from Azure succesfully processed", len(csp_instances))
 
     if ProviderChoice.from_str(provider) == ProviderChoice.EC2:
-        instance_quantity = 0
-        for region in EC2(namespace).all_regions:
-            instances = EC2(namespace).list_instances(region=region)
-            instance_quantity += len(instances)
-            for i in instances:
-                save_or_update_instance(ec2_extract_data(i, namespace, region, default_ttl))
-        logger.info("%d instances from EC2 successfully processed", instance_quantity)
+        csp_instances.extend(ec2_extract_data(i, namespace, region, default_ttl)
+                             for region, i in EC2(namespace).list_all_instances())
+        logger.info("%d instances from EC2 successfully processed", len(csp_instances))
 
     if ProviderChoice.from_str(provider) == ProviderChoice.GCE:
         instances = GCE(namespace).list_all_instances()
-        for i in instances:
-            save_or_update_instance(gce_extract_data(i, namespace, default_ttl))
+        csp_instances.extend(gce_extract_data(i, namespace, default_ttl) for i in instances)
         logger.info("%d instances from GCE successfully processed", len(instances))
-    Instance.objects.filter(provider=provider, namespace=namespace,
-                            active=False).update(state=StateChoice.DELETED)
+    sync_instances(provider, namespace, csp_instances)
+
+
+def _sync_provider(provider: str, namespace: str, default_ttl: int) -> None:
+    try:
+        _update_provider(provider, namespace, default_ttl)
+    finally:
+        # every worker thread opens its own DB connection which needs to be released
+        connections.close_all()
 
 
 def update_run() -> None:
@@ -138,16 +161,22 @@ def update_run() -> None:
     Each update is using Instance.active to mark the model is still availalbe on CSP.
     Instance.state is used to reflect the "local" state, e.g. if someone triggered a delete, the
     state will moved to DELETING. If the instance is gone from CSP, the state will set to DELETED.
+    All namespace/provider pairs are synced concurrently (see updaterun/max_workers in pcw.ini).
     '''
     global RUNNING, LAST_UPDATE
     RUNNING = True
     error_occured = False
-    for namespace in PCWConfig.get_namespaces_for('default'):
-        default_ttl = PCWConfig.get_feature_property('updaterun', 'default_ttl', namespace)
-        for provider in PCWConfig.get_providers_for('default', namespace):
-            logger.info("[%s] Check provider %s", namespace, provider)
+    max_workers = PCWConfig.get_feature_property('updaterun', 'max_workers')
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='updaterun') as executor:
+        tasks = {}
+        for namespace in PCWConfig.get_namespaces_for('default'):
+            default_ttl = PCWConfig.get_feature_property('updaterun', 'default_ttl', namespace)
+            for provider in PCWConfig.get_providers_for('default', namespace):
+                logger.info("[%s] Check provider %s", namespace, provider)
+                tasks[executor.submit(_sync_provider, provider, namespace, default_ttl)] = (namespace, provider)
+        for task, (namespace, provider) in tasks.items():
             try:
-                _update_provider(provider, namespace, default_ttl)
+                task.result()
             except Exception:
                 logger.exception("[%s] Update failed for %s", namespace, provider)
                 error_occured = True
@@ -236,7 +265,11 @@ def delete_instance(instance: type[Instance]) -> None:
         return
 
     if instance.provider == ProviderChoice.AZURE:
-        Azure(instance.namespace).delete_resource(instance.instance_id)
+        if not Azure(instance.namespace).delete_resource(instance.instance_id):
+            # instance stays ACTIVE so next update run issues its deletion again
+            logger.info("[%s] Deletion of %s postponed, too many Azure deletions are in flight",
+                        instance.namespace, instance.instance_id)
+            return
     elif instance.provider == ProviderChoice.EC2:
         EC2(instance.namespace).delete_instance(instance.region, instance.instance_id)
     elif instance.provider == ProviderChoice.GCE:
@@ -250,6 +283,35 @@ def delete_instance(instance: type[Instance]) -> None:
     instance.save()
 
 
+def delete_ec2_instances(namespace: str, instances: list[Instance]) -> list[str]:
+    """
+    Terminate EC2 instances with one call per region and mark the terminated ones as DELETING in bulk.
+    Returns error messages of instances which could not be deleted.
+    """
+    by_region = defaultdict(list)
+    for instance in instances:
+        by_region[instance.region].append(instance)
+    errors = []
+    deleting = []
+    for region, region_instances in by_region.items():
+        try:
+            failed = EC2(namespace).delete_instances(region, [i.instance_id for i in region_instances])
+        except Exception:
+            msg = f"[{namespace}] Deleting instances in {ProviderChoice.EC2}:{region} failed"
+            logger.exception(msg)
+            errors.append(f"{msg}\n\n{traceback.format_exc()}")
+            continue
+        for instance in region_instances:
+            if instance.instance_id in failed:
+                msg = f"[{namespace}] Deleting instance ({instance.provider}:{instance.instance_id}) failed"
+                logger.error("%s: %s", msg, failed[instance.instance_id])
+                errors.append(f"{msg}\n\n{failed[instance.instance_id]}")
+            else:
+                deleting.append(instance.pk)
+    Instance.objects.filter(pk__in=deleting).update(state=StateChoice.DELETING, deleting_since=datetime.now(tz=timezone.utc))
+    return errors
+
+
 def auto_delete_instances() -> None:
     for namespace in PCWConfig.get_namespaces_for('default'):
         logger.debug("Running auto_delete_instances for %s", namespace)
@@ -259,6 +321,7 @@ def auto_delete_instances() -> None:
         ]
         logger.debug("Found %d instances for deletion", len(instances))
         email_text = set()
+        ec2_instances = []
         for instance in instances:
             if instance.ttl_expired():
                 logger.debug("[%s] TTL expired for instance %s:%s %s", instance.namespace,
@@ -266,12 +329,18 @@ def auto_delete_instances() -> None:
             else:
                 logger.debug("[%s] Job cancelled for instance %s:%s %s", instance.namespace,
                              instance.provider, instance.instance_id, instance.all_time_fields())
+            if instance.provider == ProviderChoice.EC2:
+                # terminated in batches below
+                ec2_instances.append(instance)
+                continue
             try:
                 delete_instance(instance)
             except Exception:
                 msg = f"[{instance.namespace}] Deleting instance ({instance.provider}:{instance.instance_id}) failed"
                 logger.exception(msg)
                 email_text.add(f"{msg}\n\n{traceback.format_exc()}")
+        if ec2_instances:
+            email_text.update(delete_ec2_instances(namespace, ec2_instances))
 
         if len(email_text) > 0:
             send_mail(f'[{namespace}] Error on auto deleting instance(s)', f"\n{'#'*79}\n".join(email_text))
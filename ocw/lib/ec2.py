@@ -1,12 +1,15 @@
+import re
 import traceback
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
-from typing import Dict
+from typing import Callable, Dict, Iterator
 import boto3
 from botocore.exceptions import ClientError
 from dateutil.parser import parse
 from webui.PCWConfig import PCWConfig, ConfigFile
 from ocw.lib.emailnotify import send_mail
+from .aws import AWSClients
 from .provider import Provider
 from ..models import Instance
 
@@ -14,25 +17,27 @@ from ..models import Instance
 class EC2(Provider):
     __instances: Dict[str, "EC2"] = {}
     default_region: str = 'eu-central-1'
+    # amount of instance ids passed to single TerminateInstances call
+    TERMINATE_BATCH_SIZE: int = 200
 
     def __init__(self, namespace: str):
         super().__init__(namespace)
-        self.check_credentials()
-        if PCWConfig.has('default/ec2_regions'):
-            self.all_regions = ConfigFile().getList('default/ec2_regions')
-        else:
-            self.all_regions = self.get_all_regions()
+        self.ensure_credentials(self.check_credentials)
 
     def __new__(cls, namespace: str):
         if namespace not in EC2.__instances:
             EC2.__instances[namespace] = self = object.__new__(cls)
-            self.__ec2_client = {}
-            self.__ec2_resource = {}
             self.__secret = None
             self.__key = None
 
         return EC2.__instances[namespace]
 
+    @property
+    def all_regions(self) -> list:
+        if PCWConfig.has('default/ec2_regions'):
+            return ConfigFile().getList('default/ec2_regions')
+        return self.cached_regions(self.get_all_regions)
+
     def check_credentials(self) -> None:
         self.__secret = self.get_data('secret_access_key')
         self.__key = self.get_data('access_key_id')
@@ -47,29 +52,28 @@ class EC2(Provider):
         raise ValueError("Invalid EC2 credentials")
 
     def ec2_resource(self, region: str) -> "boto3.session.Session.resource":
-        if region not in self.__ec2_resource:
-            self.__ec2_resource[region] = boto3.resource('ec2', aws_access_key_id=self.__key,
-                                                         aws_secret_access_key=self.__secret,
-                                                         region_name=region)
-        return self.__ec2_resource[region]
+        return AWSClients.resource(self._namespace, 'ec2', region, self.__key, self.__secret)
 
     def ec2_client(self, region: str) -> "boto3.session.Session.client":
-        if region not in self.__ec2_client:
-            self.__ec2_client[region] = boto3.client('ec2', aws_access_key_id=self.__key,
-                                                     aws_secret_access_key=self.__secret,
-                                                     region_name=region)
-        return self.__ec2_client[region]
+        return AWSClients.client(self._namespace, 'ec2', region, self.__key, self.__secret)
 
     @staticmethod
     def is_outdated(creation_time: datetime, valid_period_days: float) -> bool:
         return datetime.date(creation_time) < (date.today() - timedelta(days=valid_period_days))
 
+    def paginate(self, region: str, operation: str, result_key: str, **kwargs) -> Iterator[dict]:
+        """ Stream items of all pages of describe_* call. Use server side Filters to limit amount of returned items """
+        for page in self.ec2_client(region).get_paginator(operation).paginate(**kwargs):
+            yield from page[result_key]
+
     def cleanup_snapshots(self, valid_period_days: float) -> None:
         self.log_dbg("Call clean_snapshots")
         for region in self.all_regions:
-            response = self.ec2_client(region).describe_snapshots(OwnerIds=['self'])
-            self.log_dbg(f"Found {len(response['Snapshots'])} snapshots in {region}")
-            for snapshot in response['Snapshots']:
+            found = 0
+            # snapshots which are still pending can not be deleted
+            for snapshot in self.paginate(region, 'describe_snapshots', 'Snapshots', OwnerIds=['self'],
+                                          Filters=[{'Name': 'status', 'Values': ['completed', 'error']}]):
+                found += 1
                 if EC2.is_outdated(snapshot['StartTime'], valid_period_days):
                     if self.dry_run:
                         self.log_info(f"Snapshot deletion of {snapshot['SnapshotId']} skipped due to dry run mode")
@@ -84,13 +88,16 @@ class EC2(Provider):
                                 self.log_info(ex.response['Error']['Message'])
                             else:
                                 raise ex
+            self.log_dbg(f"Found {found} snapshots in {region}")
 
     def cleanup_volumes(self, valid_period_days: float) -> None:
         self.log_dbg("Call cleanup_volumes")
         for region in self.all_regions:
-            response = self.ec2_client(region).describe_volumes()
-            self.log_dbg(f"Found {len(response['Volumes'])} volumes in {region}")
-            for volume in response['Volumes']:
+            found = 0
+            # volumes attached to instances can not be deleted so there is no point to fetch them
+            for volume in self.paginate(region, 'describe_volumes', 'Volumes',
+                                        Filters=[{'Name': 'status', 'Values': ['available']}]):
+                found += 1
                 if EC2.is_outdated(volume['CreateTime'], valid_period_days):
                     if self.volume_protected(volume):
                         self.log_info(f"Volume {volume['VolumeId']} has tag pcw_ignore so protected from deletion")
@@ -105,6 +112,7 @@ class EC2(Provider):
                                 self.log_info(ex.response['Error'])
                             else:
                                 raise ex
+            self.log_dbg(f"Found {found} available volumes in {region}")
 
     def volume_protected(self, volume: dict) -> bool:
         if 'Tags' in volume:
@@ -113,15 +121,45 @@ class EC2(Provider):
                     return True
         return False
 
-    def list_instances(self, region: str) -> list:
-        return list(self.ec2_resource(region).instances.all())
+    def list_instances(self, region: str) -> list[dict]:
+        """ List instances of region as lightweight records containing only fields needed by PCW """
+        return [
+            {
+                'InstanceId': instance['InstanceId'],
+                'LaunchTime': instance['LaunchTime'],
+                'InstanceType': instance['InstanceType'],
+                'Tags': instance.get('Tags', []),
+                'State': instance['State']['Name'],
+            }
+            for reservation in self.paginate(region, 'describe_instances', 'Reservations')
+            for instance in reservation['Instances']
+        ]
+
+    def list_all_instances(self) -> Iterator[tuple[str, object]]:
+        """
+            Query all regions concurrently (at most default/ec2_max_workers at once) and yield
+            (region, instance) pairs. Listing which does not finish within default/ec2_list_timeout
+            seconds overall interrupts the listing with TimeoutError instead of stalling the caller.
+        """
+        max_workers = PCWConfig.get_feature_property('default', 'ec2_max_workers', self._namespace)
+        timeout = PCWConfig.get_feature_property('default', 'ec2_list_timeout', self._namespace)
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ec2-regions')
+        try:
+            futures = {region: executor.submit(self.list_instances, region) for region in self.all_regions}
+            deadline = time.monotonic() + timeout
+            for region, future in futures.items():
+                try:
+                    instances = future.result(timeout=max(0, deadline - time.monotonic()))
+                except TimeoutError as ex:
+                    raise TimeoutError(f"Listing of instances in {region} did not finish within overall {timeout} seconds") from ex
+                self.log_dbg(f"Found {len(instances)} instances in {region}")
+                for instance in instances:
+                    yield region, instance
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
     def count_all_instances(self) -> int:
-        instance_quantity = 0
-        for region in self.all_regions:
-            instances = self.list_instances(region=region)
-            instance_quantity += len(instances)
-        return instance_quantity
+        return sum(1 for _ in self.list_all_instances())
 
     def get_all_regions(self) -> list:
         regions_resp = self.ec2_client(EC2.default_region).describe_regions()
@@ -129,17 +167,45 @@ class EC2(Provider):
         return regions
 
     def delete_instance(self, region: str, instance_id: str):
-        try:
-            if self.dry_run:
-                self.log_info(f"Instance termination {instance_id} skipped due to dry run mode")
-            else:
-                self.log_info(f"Deleting {instance_id}", instance_id)
-                self.ec2_resource(region).instances.filter(InstanceIds=[instance_id]).terminate()
-        except ClientError as ex:
-            if ex.response['Error']['Code'] == 'InvalidInstanceID.NotFound':
-                self.log_warn(f"Failed to delete instance with id {instance_id}. It does not exists on EC2")
-            else:
-                raise ex
+        failed = self.delete_instances(region, [instance_id])
+        if instance_id in failed:
+            raise failed[instance_id]
+
+    def delete_instances(self, region: str, instance_ids: list[str]) -> dict[str, ClientError]:
+        """
+            Terminate instances of one region with one TerminateInstances call per TERMINATE_BATCH_SIZE ids.
+            Instances which do not exist anymore are skipped with a warning. When a batch fails for other
+            reason its instances are terminated one by one to find out which of them is failing.
+            :return: errors of instances which could not be terminated by instance id
+        """
+        failed = {}
+        if self.dry_run:
+            self.log_info(f"Instance termination {', '.join(instance_ids)} skipped due to dry run mode")
+            return failed
+        for start in range(0, len(instance_ids), EC2.TERMINATE_BATCH_SIZE):
+            batch = instance_ids[start:start + EC2.TERMINATE_BATCH_SIZE]
+            while batch:
+                try:
+                    self.log_info(f"Deleting {', '.join(batch)} in {region}")
+                    self.ec2_client(region).terminate_instances(InstanceIds=batch)
+                    break
+                except ClientError as ex:
+                    not_found = ex.response['Error']['Code'] == 'InvalidInstanceID.NotFound'
+                    missing = set(re.findall(r"i-[0-9a-f]+", ex.response['Error']['Message'])) & set(batch) if not_found else set()
+                    if missing:
+                        for instance_id in sorted(missing):
+                            self.log_warn(f"Failed to delete instance with id {instance_id}. It does not exists on EC2")
+                        batch = [instance_id for instance_id in batch if instance_id not in missing]
+                        continue
+                    if len(batch) > 1:
+                        for instance_id in batch:
+                            failed.update(self.delete_instances(region, [instance_id]))
+                    elif not_found:
+                        self.log_warn(f"Failed to delete instance with id {batch[0]}. It does not exists on EC2")
+                    else:
+                        failed[batch[0]] = ex
+                    break
+        return failed
 
     def cleanup_all(self) -> None:
         valid_period_days = PCWConfig.get_feature_property('cleanup', 'ec2-max-age-days', self._namespace)
@@ -152,16 +218,43 @@ class EC2(Provider):
         if PCWConfig.getBoolean('cleanup/vpc_cleanup', self._namespace):
             self.cleanup_vpcs()
 
-    def delete_vpc(self, region: str, vpc, vpc_id: str):
+    @staticmethod
+    def run_parallel(executor: ThreadPoolExecutor | None, *calls: Callable) -> None:
+        """ Run independent calls on executor and raise the first error once all of them are finished.
+        Calls run one after another in current thread when there is no executor """
+        if executor is None:
+            for call in calls:
+                call()
+            return
+        futures = [executor.submit(call) for call in calls]
+        for future in futures:
+            future.result()
+
+    def vpc(self, region: str, vpc_id: str):
+        """ boto3 resources are not thread safe so every thread builds own Vpc from its thread local resource """
+        return self.ec2_resource(region).Vpc(vpc_id)
+
+    def delete_vpc(self, region: str, vpc_id: str, stages: ThreadPoolExecutor | None = None):
+        """ :param stages: long-lived executor running sub-resource deletions of one stage in parallel, its threads
+            are reused across VPCs so their thread local boto3 resources are built only once """
         try:
-            self.log_info(f'{vpc} has no associated instances. Initializing cleanup of it')
-            self.delete_routing_tables(region, vpc_id)
-            self.delete_security_groups(vpc)
-            self.delete_network_acls(vpc)
-            self.delete_vpc_subnets(vpc)
-            self.delete_internet_gw(vpc)
-            self.delete_vpc_endpoints(region, vpc_id)
-            self.delete_vpc_peering_connections(region, vpc_id)
+            self.log_info(f'{vpc_id} has no associated instances. Initializing cleanup of it')
+            # sub-resources are deleted in stages, resources within one stage don't depend on each other.
+            # Network interfaces need to be gone before security groups, ACLs and internet gateway
+            # (mapped public addresses) can be removed and interface endpoints hold interfaces in subnets
+            self.run_parallel(
+                stages,
+                lambda: self.delete_routing_tables(region, vpc_id),
+                lambda: self.delete_vpc_endpoints(region, vpc_id),
+                lambda: self.delete_vpc_peering_connections(region, vpc_id),
+            )
+            self.delete_vpc_subnets(self.vpc(region, vpc_id))
+            self.run_parallel(
+                stages,
+                lambda: self.delete_security_groups(self.vpc(region, vpc_id)),
+                lambda: self.delete_network_acls(self.vpc(region, vpc_id)),
+                lambda: self.delete_internet_gw(self.vpc(region, vpc_id)),
+            )
             if self.dry_run:
                 self.log_info('Deletion of VPC skipped due to dry_run mode')
             else:
@@ -293,32 +386,53 @@ class EC2(Provider):
         self.log_dbg('Do cleanup of VPCs')
         vpc_errors = []
         vpc_notify = []
-        for region in self.all_regions:
-            response = self.ec2_client(region).describe_vpcs(Filters=[{'Name': 'isDefault', 'Values': ['false']}])
-            self.log_dbg(f"Found {len(response['Vpcs'])} VPC's in {region}")
-            for response_vpc in response['Vpcs']:
-                vpc_id = response_vpc['VpcId']
-                if self.volume_protected(response_vpc):
-                    self.log_dbg(f'{vpc_id} has protection tag pcw_ignore obey the order!')
-                    continue
-                self.log_dbg(f"Found {vpc_id} in {region}. (OwnerId={response_vpc['OwnerId']}).")
+        # VPCs are deleted in parallel while next regions are being listed
+        deletions = []
+        max_workers = PCWConfig.get_feature_property('cleanup', 'vpc-max-workers', self._namespace)
+        # every VPC deletion runs up to 3 parallel calls per stage
+        with (
+            ThreadPoolExecutor(max_workers=max_workers * 3, thread_name_prefix='ec2-vpc-resources') as stages,
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ec2-vpc') as executor,
+        ):
+            for region in self.all_regions:
+                response = self.ec2_client(region).describe_vpcs(Filters=[{'Name': 'isDefault', 'Values': ['false']}])
+                self.log_dbg(f"Found {len(response['Vpcs'])} VPC's in {region}")
+                vpc_ids = []
+                for response_vpc in response['Vpcs']:
+                    vpc_id = response_vpc['VpcId']
+                    if self.volume_protected(response_vpc):
+                        self.log_dbg(f'{vpc_id} has protection tag pcw_ignore obey the order!')
+                        continue
+                    self.log_dbg(f"Found {vpc_id} in {region}. (OwnerId={response_vpc['OwnerId']}).")
+                    vpc_ids.append(vpc_id)
                 if PCWConfig.getBoolean('cleanup/vpc-notify-only', self._namespace):
-                    vpc_notify.append(vpc_id)
-                else:
-                    resource_vpc = self.ec2_resource(region).Vpc(vpc_id)
-                    if self.vpc_can_be_deleted(resource_vpc, vpc_id):
-                        del_responce = self.delete_vpc(region, resource_vpc, vpc_id)
-                        if del_responce is not None:
-                            self.log_err(del_responce)
-                            vpc_errors.append(del_responce)
+                    vpc_notify.extend(vpc_ids)
+                    continue
+                busy_vpcs = self.busy_vpcs(region, vpc_ids)
+                for vpc_id in vpc_ids:
+                    if vpc_id in busy_vpcs:
+                        self.log_info(f'{vpc_id} has associated instance(s) so can not be deleted')
+                    else:
+                        deletions.append(executor.submit(self.delete_vpc, region, vpc_id, stages))
+        for deletion in deletions:
+            del_responce = deletion.result()
+            if del_responce is not None:
+                self.log_err(del_responce)
+                vpc_errors.append(del_responce)
         self.report_cleanup_results(vpc_errors, vpc_notify)
 
-    def vpc_can_be_deleted(self, resource_vpc, vpc_id) -> bool:
-        for subnet in resource_vpc.subnets.all():
-            if len(list(subnet.instances.all())) > 0:
-                self.log_info(f'{vpc_id} has associated instance(s) so can not be deleted')
-                return False
-        return True
+    def busy_vpcs(self, region: str, vpc_ids: list[str]) -> set[str]:
+        """ Return those of vpc_ids which have not terminated instances using single paginated describe_instances call """
+        busy = set()
+        # EC2 accepts at most 200 values per filter
+        for start in range(0, len(vpc_ids), 200):
+            filters = [
+                {'Name': 'vpc-id', 'Values': vpc_ids[start:start + 200]},
+                {'Name': 'instance-state-name', 'Values': ['pending', 'running', 'shutting-down', 'stopping', 'stopped']},
+            ]
+            for reservation in self.paginate(region, 'describe_instances', 'Reservations', Filters=filters):
+                busy.update(instance['VpcId'] for instance in reservation['Instances'] if 'VpcId' in instance)
+        return busy
 
     def report_cleanup_results(self, vpc_errors: list, vpc_notify: list) -> None:
         if len(vpc_errors) > 0:
@@ -341,8 +455,7 @@ class EC2(Provider):
     def count_all_volumes(self) -> int:
         all_volumes_cnt = 0
         for region in self.all_regions:
-            response = self.ec2_client(region).describe_volumes()
-            all_volumes_cnt += len(response['Volumes'])
+            all_volumes_cnt += sum(1 for _ in self.paginate(region, 'describe_volumes', 'Volumes'))
         return all_volumes_cnt
 
     def count_all_vpc(self) -> int:
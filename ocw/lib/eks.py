@@ -5,6 +5,7 @@ from datetime import datetime, timedelta, timezone
 import kubernetes
 import boto3
 from webui.PCWConfig import PCWConfig, ConfigFile
+from ocw.lib.aws import AWSClients
 from ocw.lib.provider import Provider
 from ocw.lib.k8s import clean_jobs, clean_namespaces
 
@@ -14,12 +15,10 @@ TAG_IGNORE = 'pcw_ignore'
 class EKS(Provider):
     __instances = {}
     default_region: str = 'eu-central-1'
-    __cluster_regions = []
 
     def __new__(cls, namespace):
         if namespace not in EKS.__instances:
             EKS.__instances[namespace] = self = object.__new__(cls)
-            self.__eks_client = {}
             self.__kubectl_client = {}
             self.__aws_dir = None
 
@@ -27,14 +26,18 @@ class EKS(Provider):
 
     def __init__(self, namespace: str):
         super().__init__(namespace)
-        self.create_credentials_file()
-        if len(EKS.__cluster_regions) == 0:
-            if PCWConfig.has('clusters/ec2_regions'):
-                EKS.__cluster_regions = ConfigFile().getList('clusters/ec2_regions')
-            else:
-                regions_query = self.cmd_exec(f"aws ec2 describe-regions --query 'Regions[].RegionName'\
-                                               --output json --region {EKS.default_region}")
-                EKS.__cluster_regions = json.loads(regions_query.stdout)
+        self.ensure_credentials(self.create_credentials_file)
+
+    @property
+    def cluster_regions(self) -> list:
+        if PCWConfig.has('clusters/ec2_regions'):
+            return ConfigFile().getList('clusters/ec2_regions')
+        return self.cached_regions(self.get_all_regions)
+
+    def get_all_regions(self) -> list:
+        regions_query = self.cmd_exec(f"aws ec2 describe-regions --query 'Regions[].RegionName'\
+                                       --output json --region {EKS.default_region}")
+        return json.loads(regions_query.stdout)
 
     def aws_dir(self):
         if self.__aws_dir is None:
@@ -59,12 +62,8 @@ class EKS(Provider):
                                f"'aws sts get-caller-identity' with the error: {res.stderr}")
 
     def eks_client(self, region: str) -> "boto3.session.Session.client":
-        if region not in self.__eks_client:
-            self.__eks_client[region] = boto3.client('eks',
-                                                     aws_access_key_id=self.auth_json['access_key_id'],
-                                                     aws_secret_access_key=self.auth_json['secret_access_key'],
-                                                     region_name=region)
-        return self.__eks_client[region]
+        return AWSClients.client(self._namespace, 'eks', region,
+                                 self.auth_json['access_key_id'], self.auth_json['secret_access_key'])
 
     def kubectl_client(self, region: str, cluster_name: str):
         region_cluster = f"{region}/{cluster_name}"
@@ -85,7 +84,7 @@ class EKS(Provider):
 
     def all_clusters(self) -> dict:
         clusters = {}
-        for region in EKS.__cluster_regions:
+        for region in self.cluster_regions:
             self.log_dbg(f"Checking clusters in {region}")
             response = self.eks_client(region).list_clusters()
             if 'clusters' in response and len(response['clusters']) > 0:
@@ -141,7 +140,7 @@ class EKS(Provider):
 
     def delete_all_clusters(self) -> None:
         self.log_info("Deleting all clusters!")
-        for region in self.__cluster_regions:
+        for region in self.cluster_regions:
             response = self.eks_client(region).list_clusters()
             if len(response['clusters']):
                 self.log_dbg(f"Found {len(response['clusters'])} cluster(s) in {region}")
@@ -156,7 +155,7 @@ class EKS(Provider):
 
     def cleanup_k8s_jobs(self):
         self.log_info("Cleanup jobs in EKS clusters")
-        for region in self.__cluster_regions:
+        for region in self.cluster_regions:
             self.log_dbg(f"Region {region}")
             clusters = self.eks_client(region).list_clusters()['clusters']
             for cluster_name in clusters:
@@ -166,7 +165,7 @@ class EKS(Provider):
 
     def cleanup_k8s_namespaces(self):
         self.log_info("Cleanup namespaces in EKS clusters")
-        for region in self.__cluster_regions:
+        for region in self.cluster_regions:
             self.log_dbg(f"Region {region}")
             clusters = self.eks_client(region).list_clusters()['clusters']
             for cluster_name in clusters:
@@ -1,7 +1,12 @@
 import contextlib
+import functools
 import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from os.path import basename
 from datetime import timezone
+from typing import Iterator
 from dateutil.parser import parse
 import googleapiclient.discovery
 from googleapiclient.errors import HttpError
@@ -12,11 +17,32 @@ from .provider import Provider
 
 class GCE(Provider):
     __instances = {}
+    # maximal amount of calls in single batch request supported by the APIs
+    COMPUTE_BATCH_LIMIT = 1000
+    STORAGE_BATCH_LIMIT = 100
+    # cleanup passes with the passes which need to be finished before it may start.
+    # Networks can be deleted only when nothing is attached to them anymore, backend services
+    # are referenced by forwarding rules and instance groups by backend services
+    CLEANUP_DEPENDENCIES = {
+        "cleanup_blobs": (),
+        "cleanup_disks": (),
+        "cleanup_images": (),
+        "cleanup_forwarding_rules": (),
+        "cleanup_region_backend_services": ("cleanup_forwarding_rules",),
+        "cleanup_instance_groups": ("cleanup_region_backend_services",),
+        "cleanup_firewalls": (),
+        "cleanup_routes": (),
+        "cleanup_subnetworks": ("cleanup_forwarding_rules", "cleanup_instance_groups"),
+        "cleanup_networks": ("cleanup_subnetworks", "cleanup_routes", "cleanup_firewalls"),
+    }
 
     def __new__(cls, namespace):
-        if namespace not in GCE.__instances:
-            GCE.__instances[namespace] = object.__new__(cls)
-        return GCE.__instances[namespace]
+        # GKE is subclassing GCE so singletons need to be distinguished by class
+        if (cls, namespace) not in GCE.__instances:
+            GCE.__instances[(cls, namespace)] = self = object.__new__(cls)
+            # httplib2 used by googleapiclient is not thread safe so every thread gets own clients
+            self.__clients = threading.local()
+        return GCE.__instances[(cls, namespace)]
 
     def __init__(self, namespace):
         super().__init__(namespace)
@@ -26,50 +52,108 @@ class GCE(Provider):
         except LookupError:
             self.__bucket = None
         self.__skip_networks = frozenset(ConfigFile().getList('cleanup/gce-skip-networks', ["default"]))
-
-        self.__compute_client = None
-        self.__storage_client = None
         self.private_key_data = self.get_data()
         self.project = self.private_key_data["project_id"]
 
-    def _paginated(self, api_call, **kwargs) -> list:
-        results = []
+    def _iter_paginated(self, api_call, fields: str | None = None, **kwargs) -> Iterator[dict]:
+        """ Yield items of list call page by page.
+        :param fields: comma separated fields of items which should be returned (partial response),
+            all fields are returned when not set
+        """
+        if fields is not None:
+            kwargs["fields"] = f"nextPageToken,items({fields})"
         request = api_call().list(**kwargs)
         while request is not None:
-            response = request.execute()
+            try:
+                response = request.execute()
+            except HttpError as exc:
+                if GCE.get_error_reason(exc) == 'notFound' and ('zone' in kwargs or 'region' in kwargs):
+                    self.log_dbg(f"Scope {kwargs.get('zone', kwargs.get('region'))} not found. Invalidating topology cache")
+                    self.invalidate_cached('topology')
+                    return
+                raise exc
             if "items" in response:
-                results.extend(response["items"])
+                yield from response["items"]
             else:
                 self.log_dbg(f"response has no items. id={response.get('id')}")
             request = api_call().list_next(previous_request=request, previous_response=response)
-        return results
-
-    def _delete_resource(self, api_call, resource_name, *_, **kwargs) -> None:
-        resource_type = {
-            self.storage_client().objects: "blob",
-            self.compute_client().disks: "disk",
-            self.compute_client().firewalls: "firewall",
-            self.compute_client().forwardingRules: "forwardingRule",
-            self.compute_client().images: "image",
-            self.compute_client().instances: "instance",
-            self.compute_client().instanceGroups: "instanceGroup",
-            self.compute_client().networks: "network",
-            self.compute_client().regionBackendServices: "regionBackendService",
-            self.compute_client().routes: "route",
-            self.compute_client().subnetworks: "subnetwork",
-        }.get(api_call, "resource")
-
-        # Get object details / metadata and check the labels
-        resource_details = api_call().get(**kwargs).execute()
+
+    def _paginated(self, api_call, **kwargs) -> list:
+        return list(self._iter_paginated(api_call, **kwargs))
+
+    def _list_outdated(self, api_call, resource_type: str, fields: str, **kwargs) -> list[dict]:
+        """ Stream resources and keep only outdated ones which are not attached to networks from cleanup/gce-skip-networks
+        :param fields: item fields of partial response, must contain labels when resource type has them
+            because pcw_ignore label is checked on listed resource
+        """
+        found = 0
+        outdated = []
+        for resource in self._iter_paginated(api_call, fields=fields, **kwargs):
+            if "network" in resource and basename(resource["network"]) in self.__skip_networks:
+                continue
+            found += 1
+            if self.is_outdated(parse(resource.get("creationTimestamp", resource.get("timeCreated"))).astimezone(timezone.utc)):
+                outdated.append(resource)
+        scope = kwargs.get("zone", kwargs.get("region"))
+        self.log_dbg(f"{found} {resource_type}s found" + (f" in {scope}" if scope else ""))
+        return outdated
+
+    def _aggregated(self, api_call, items_key: str, **kwargs) -> tuple[list, list]:
+        """ Collect items of all scopes (zones/regions) via aggregatedList and return them with list of unreachable scopes """
+        results = []
+        unreachables = []
+        request = api_call().aggregatedList(returnPartialSuccess=True, **kwargs)
+        while request is not None:
+            response = request.execute()
+            for scope in response.get("items", {}).values():
+                results.extend(scope.get(items_key, []))
+            unreachables.extend(response.get("unreachables", []))
+            request = api_call().aggregatedList_next(previous_request=request, previous_response=response)
+        return results, unreachables
+
+    def _skip_deletion(self, resource_type: str, resource_name: str, resource_details: dict) -> bool:
         labels = resource_details.get('labels', {})
         if labels:
             self.log_dbg(f"Resource {resource_type}/{resource_name} has these labels: {labels}")
             if 'pcw_ignore' in labels:
                 self.log_info(f"Skipping deletion of {resource_type} {resource_name} due to 'pcw_ignore' label set on resource")
-                return
-
+                return True
         if self.dry_run:
             self.log_info(f"Deletion of {resource_type} {resource_name} skipped due to dry run mode")
+            return True
+        return False
+
+    def _handle_delete_error(self, resource_type: str, resource_name: str, err: HttpError) -> None:
+        error_reason = GCE.get_error_reason(err)
+        log_msg = f"{resource_type.title()} '{resource_name}' can not be deleted. {err}"
+        if error_reason == 'resourceInUseByAnotherResource':
+            self.log_dbg(f"{resource_type.title()} '{resource_name}' can not be deleted because in use")
+        elif error_reason == 'badRequest':
+            # These are system generated routes when you create a network. These
+            # will be deleted by the deletion of the network and do not block the
+            # deletion of that network.
+            # There are no properties on the Route struct that indicate a route is a
+            # default one. Typically, the name will contain the word "default" or the
+            # description will contain the word "Default" but a property like Kind
+            # returns "compute#route" for all routes.
+            # All this creating false alarms in log which we want to prevent.
+            # Only way to prevent is mute error
+            if resource_type.title() == "Route":
+                self.log_info("Skip deletion of local route")
+            else:
+                self.log_err(log_msg)
+        elif error_reason == 'resourceIsManaged' and resource_type.title() == 'Instancegroup':
+            self.log_err(log_msg)
+        else:
+            raise err
+
+    def _delete_resource(self, api_call, resource_type: str, resource_name: str, resource_details: dict | None = None,
+                         **kwargs) -> None:
+        """ Delete resource unless it has 'pcw_ignore' label. Labels are taken from resource_details which callers
+        already got from list response. Only when it is not provided resource details are fetched from the API """
+        if resource_details is None:
+            resource_details = api_call().get(**kwargs).execute()
+        if self._skip_deletion(resource_type, resource_name, resource_details):
             return
         request = api_call().delete(**kwargs)
         try:
@@ -78,44 +162,58 @@ class GCE(Provider):
             self.log_dbg(f"Deletion response: {response}")
             self.log_info(f"{resource_type.title()} '{resource_name}' deleted")
         except HttpError as err:
-            error_reason = GCE.get_error_reason(err)
-            log_msg = f"{resource_type.title()} '{resource_name}' can not be deleted. {err}"
-            if error_reason == 'resourceInUseByAnotherResource':
-                self.log_dbg(f"{resource_type.title()} '{resource_name}' can not be deleted because in use")
-            elif error_reason == 'badRequest':
-                # These are system generated routes when you create a network. These
-                # will be deleted by the deletion of the network and do not block the
-                # deletion of that network.
-                # There are no properties on the Route struct that indicate a route is a
-                # default one. Typically, the name will contain the word "default" or the
-                # description will contain the word "Default" but a property like Kind
-                # returns "compute#route" for all routes.
-                # All this creating false alarms in log which we want to prevent.
-                # Only way to prevent is mute error
-                if resource_type.title() == "Route":
-                    self.log_info("Skip deletion of local route")
-                else:
-                    self.log_err(log_msg)
-            elif error_reason == 'resourceIsManaged' and resource_type.title() == 'Instancegroup':
-                self.log_err(log_msg)
+            self._handle_delete_error(resource_type, resource_name, err)
+
+    def _delete_resources(self, api_call, resource_type: str, deletions: list[tuple[dict, dict]]) -> None:
+        """ Delete resources of one type using batch requests of up to API limit of calls.
+        :param deletions: pairs of resource details from list response and arguments of the delete call
+        """
+        deletions = [(resource, kwargs) for resource, kwargs in deletions
+                     if not self._skip_deletion(resource_type, resource["name"], resource)]
+        if resource_type == "blob":
+            client, limit = self.storage_client(), GCE.STORAGE_BATCH_LIMIT
+        else:
+            client, limit = self.compute_client(), GCE.COMPUTE_BATCH_LIMIT
+        for start in range(0, len(deletions), limit):
+            self._delete_batch(client, api_call, resource_type, deletions[start:start + limit])
+
+    @staticmethod
+    def _collect_batch_result(results: dict, request_id: str, response, exception) -> None:
+        results[request_id] = (response, exception)
+
+    def _delete_batch(self, client, api_call, resource_type: str, chunk: list[tuple[dict, dict]]) -> None:
+        """ Send deletions of chunk as single batch request and handle result of every deletion """
+        results: dict = {}
+        batch = client.new_batch_http_request(callback=functools.partial(GCE._collect_batch_result, results))
+        for idx, (resource, kwargs) in enumerate(chunk):
+            self.log_info(f"Delete {resource_type.title()} '{resource['name']}'")
+            batch.add(api_call().delete(**kwargs), request_id=str(idx))
+        batch.execute()
+        for idx, (resource, _) in enumerate(chunk):
+            response, exception = results[str(idx)]
+            if exception is None:
+                self.log_dbg(f"Deletion response: {response}")
+                self.log_info(f"{resource_type.title()} '{resource['name']}' deleted")
+            elif isinstance(exception, HttpError):
+                self._handle_delete_error(resource_type, resource["name"], exception)
             else:
-                raise err
+                raise exception
 
     def compute_client(self):
-        if self.__compute_client is None:
+        if getattr(self.__clients, "compute", None) is None:
             credentials = service_account.Credentials.from_service_account_info(self.private_key_data)
-            self.__compute_client = googleapiclient.discovery.build(
+            self.__clients.compute = googleapiclient.discovery.build(
                 "compute", "v1", credentials=credentials, cache_discovery=False
             )
-        return self.__compute_client
+        return self.__clients.compute
 
     def storage_client(self):
-        if self.__storage_client is None:
+        if getattr(self.__clients, "storage", None) is None:
             credentials = service_account.Credentials.from_service_account_info(self.private_key_data)
-            self.__storage_client = googleapiclient.discovery.build(
+            self.__clients.storage = googleapiclient.discovery.build(
                 "storage", "v1", credentials=credentials, cache_discovery=False
             )
-        return self.__storage_client
+        return self.__clients.storage
 
     def list_instances(self, zone) -> list:
         """ List all instances by zone."""
@@ -123,40 +221,50 @@ class GCE(Provider):
         return self._paginated(self.compute_client().instances, project=self.project, zone=zone)
 
     def list_all_instances(self) -> list:
-        result = []
+        """ List instances of all zones with single paginated aggregatedList call.
+        Per zone listing is used only for zones reported as unreachable or when aggregatedList fails"""
         self.log_dbg("Call list_all_instances")
-        for region in self.list_regions():
-            for zone in self.list_zones(region):
-                result.extend(self.list_instances(zone=zone))
+        try:
+            result, unreachables = self._aggregated(self.compute_client().instances, "instances", project=self.project)
+        except HttpError as exc:
+            self.log_warn(f"Aggregated listing of instances failed, falling back to listing per zone. {exc}")
+            result = []
+            unreachables = [zone for region in self.list_regions() for zone in self.list_zones(region)]
+        for zone in unreachables:
+            result.extend(self.list_instances(zone=basename(zone)))
         return result
 
-    def list_regions(self) -> list:
-        """Walk through all regions->zones and collect all instances to return them as list.
-        @see https://cloud.google.com/compute/docs/reference/rest/v1/instances/list#examples"""
+    def topology(self) -> dict[str, list]:
+        """Map of region name to names of its zones. Shared by all cleanup passes and refreshed
+        after default/regions_ttl seconds or when some region or zone turned out to not exist anymore"""
+        return self.cached('topology', self._load_topology,
+                           PCWConfig.get_feature_property('default', 'regions_ttl', self._namespace))
+
+    def _load_topology(self) -> dict[str, list]:
+        self.log_dbg("Loading regions and zones")
         regions = self._paginated(self.compute_client().regions, project=self.project)
-        return [region["name"] for region in regions]
+        topology = {}
+        for region in regions:
+            if "zones" in region:
+                topology[region["name"]] = [basename(z) for z in region["zones"]]
+            else:
+                self.log_err("Zones are missing in {}", region)
+                topology[region["name"]] = []
+        return topology
+
+    def list_regions(self) -> list:
+        """@see https://cloud.google.com/compute/docs/reference/rest/v1/regions/list"""
+        return list(self.topology())
 
     def list_zones(self, region) -> list:
-        try:
-            region = (
-                self.compute_client()
-                .regions()
-                .get(project=self.project, region=region)
-                .execute()
-            )
-            if "zones" in region:
-                return [basename(z) for z in region["zones"]]
-            self.log_err("Zones are missing in {}", region)
+        if region not in self.topology():
+            self.log_dbg("list_zones: region {} not found", region)
             return []
-        except HttpError as exc:
-            if GCE.get_error_reason(exc) == 'notFound':
-                self.log_dbg("list_zones: region {} not found", region)
-                return []
-            raise exc
+        return self.topology()[region]
 
     def delete_instance(self, instance_id, zone) -> None:
         self._delete_resource(
-            self.compute_client().instances, instance_id, project=self.project, zone=zone, instance=instance_id
+            self.compute_client().instances, "instance", instance_id, project=self.project, zone=zone, instance=instance_id
         )
 
     @staticmethod
@@ -166,165 +274,163 @@ class GCE(Provider):
         return "unknown"
 
     def cleanup_all(self) -> None:
+        """ Run cleanup passes in parallel. Each pass starts as soon as all passes from CLEANUP_DEPENDENCIES
+        it depends on are finished. When pass fails passes depending on it are skipped and the error is raised
+        after all other passes are done """
         self.log_info("Call cleanup_all")
-        if self.__bucket is not None:
-            self.cleanup_blobs()
-        self.cleanup_disks()
-        self.cleanup_images()
-        self.cleanup_region_backend_services()
-        self.cleanup_instance_groups()
-        self.cleanup_firewalls()
-        self.cleanup_forwarding_rules()
-        self.cleanup_routes()
-        self.cleanup_subnetworks()
-        self.cleanup_networks()
+        pending = dict(GCE.CLEANUP_DEPENDENCIES)
+        if self.__bucket is None:
+            pending.pop("cleanup_blobs")
+        planned = set(pending)
+        done = set()
+        failed = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=PCWConfig.get_feature_property('cleanup', 'gce-max-workers', self._namespace),
+                                thread_name_prefix=f"gce-cleanup-{self._namespace}") as executor:
+            while pending or running:
+                for name, dependencies in list(pending.items()):
+                    if any(dep in failed for dep in dependencies):
+                        self.log_warn(f"{name} skipped because {', '.join(d for d in dependencies if d in failed)} failed")
+                        failed[name] = None
+                        del pending[name]
+                    elif all(dep in done or dep not in planned for dep in dependencies):
+                        running[executor.submit(self._timed_cleanup, name)] = name
+                        del pending[name]
+                if not running:
+                    # everything left was skipped in this round
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        done.add(name)
+                    except Exception as exc:
+                        self.log_err(f"{name} failed: {exc}")
+                        failed[name] = exc
+        errors = [exc for exc in failed.values() if exc is not None]
+        if errors:
+            raise errors[0]
+
+    def _timed_cleanup(self, name: str) -> None:
+        start = time.monotonic()
+        try:
+            getattr(self, name)()
+        finally:
+            self.log_info(f"{name} finished in {time.monotonic() - start:.2f}s")
 
     def cleanup_blobs(self) -> None:
         self.log_dbg("Blobs cleanup")
-        blobs = self._paginated(self.storage_client().objects, bucket=self.__bucket)
-        self.log_dbg(f"{len(blobs)} blobs found")
-        for blob in blobs:
-            if self.is_outdated(parse(blob["timeCreated"]).astimezone(timezone.utc)):
-                self._delete_resource(
-                    self.storage_client().objects, blob["name"], bucket=self.__bucket, object=blob["name"]
-                )
+        blobs = self._list_outdated(self.storage_client().objects, "blob", "name,timeCreated", bucket=self.__bucket)
+        self._delete_resources(self.storage_client().objects, "blob", [
+            (blob, {"bucket": self.__bucket, "object": blob["name"]}) for blob in blobs
+        ])
 
     def cleanup_disks(self) -> None:
         self.log_dbg("Disks cleanup")
+        deletions = []
         for region in self.list_regions():
             for zone in self.list_zones(region):
-                self.log_dbg(f"Searching for disks in {zone}")
-                disks = self._paginated(self.compute_client().disks, project=self.project, zone=zone)
-                self.log_dbg(f"{len(disks)} disks found")
-                for disk in disks:
-                    if self.is_outdated(parse(disk["creationTimestamp"]).astimezone(timezone.utc)):
-                        self._delete_resource(
-                            self.compute_client().disks, disk["name"], project=self.project, zone=zone, disk=disk["name"]
-                        )
+                disks = self._list_outdated(self.compute_client().disks, "disk", "name,creationTimestamp,labels",
+                                            project=self.project, zone=zone)
+                deletions.extend((disk, {"project": self.project, "zone": zone, "disk": disk["name"]}) for disk in disks)
+        self._delete_resources(self.compute_client().disks, "disk", deletions)
 
     def cleanup_images(self) -> None:
         self.log_dbg("Images cleanup")
-        images = self._paginated(self.compute_client().images, project=self.project)
-        self.log_dbg(f"{len(images)} images found")
-        for image in images:
-            if self.is_outdated(parse(image["creationTimestamp"]).astimezone(timezone.utc)):
-                self._delete_resource(
-                    self.compute_client().images, image["name"], project=self.project, image=image["name"]
-                )
+        images = self._list_outdated(self.compute_client().images, "image", "name,creationTimestamp,labels",
+                                     project=self.project)
+        self._delete_resources(self.compute_client().images, "image", [
+            (image, {"project": self.project, "image": image["name"]}) for image in images
+        ])
 
     def cleanup_firewalls(self) -> None:
         self.log_dbg("Firewalls cleanup")
-        firewalls = [
-            firewall for firewall in self._paginated(self.compute_client().firewalls, project=self.project)
-            if basename(firewall["network"]) not in self.__skip_networks
-        ]
-        self.log_dbg(f"{len(firewalls)} firewalls found")
-        for firewall in firewalls:
-            if self.is_outdated(parse(firewall["creationTimestamp"]).astimezone(timezone.utc)):
-                self._delete_resource(
-                    self.compute_client().firewalls, firewall["name"], project=self.project, firewall=firewall["name"]
-                )
+        firewalls = self._list_outdated(self.compute_client().firewalls, "firewall", "name,creationTimestamp,network",
+                                        project=self.project)
+        self._delete_resources(self.compute_client().firewalls, "firewall", [
+            (firewall, {"project": self.project, "firewall": firewall["name"]}) for firewall in firewalls
+        ])
 
     def cleanup_forwarding_rules(self) -> None:
         self.log_dbg("Forwarding rules cleanup")
+        deletions = []
         for region in self.list_regions():
-            rules = [
-                rule for rule in self._paginated(self.compute_client().forwardingRules, project=self.project, region=region)
-                if basename(rule["network"]) not in self.__skip_networks
-            ]
-            self.log_dbg(f"{len(rules)} forwarding_rules found")
-            for rule in rules:
-                if self.is_outdated(parse(rule["creationTimestamp"]).astimezone(timezone.utc)):
-                    self._delete_resource(
-                        self.compute_client().forwardingRules, rule["name"],
-                        project=self.project, region=region, forwardingRule=rule["name"]
-                    )
+            rules = self._list_outdated(self.compute_client().forwardingRules, "forwardingRule",
+                                        "name,creationTimestamp,network,labels", project=self.project, region=region)
+            deletions.extend(
+                (rule, {"project": self.project, "region": region, "forwardingRule": rule["name"]}) for rule in rules
+            )
+        self._delete_resources(self.compute_client().forwardingRules, "forwardingRule", deletions)
 
     def cleanup_instance_groups(self) -> None:
         self.log_dbg("Instance groups cleanup")
+        deletions = []
         for region in self.list_regions():
             for zone in self.list_zones(region):
-                groups = self._paginated(
-                    self.compute_client().instanceGroups, project=self.project, zone=zone
+                groups = self._list_outdated(self.compute_client().instanceGroups, "instanceGroup", "name,creationTimestamp",
+                                             project=self.project, zone=zone)
+                deletions.extend(
+                    (group, {"project": self.project, "zone": zone, "instanceGroup": group["name"]}) for group in groups
                 )
-                self.log_dbg(f"{len(groups)} instance groups found")
-                for group in groups:
-                    if self.is_outdated(parse(group["creationTimestamp"]).astimezone(timezone.utc)):
-                        self._delete_resource(
-                            self.compute_client().instanceGroups, group["name"],
-                            project=self.project, zone=zone, instanceGroup=group["name"]
-                        )
+        self._delete_resources(self.compute_client().instanceGroups, "instanceGroup", deletions)
 
     def cleanup_region_backend_services(self) -> None:
         self.log_dbg("Region backend services cleanup")
+        deletions = []
         for region in self.list_regions():
-            services = self._paginated(
-                self.compute_client().regionBackendServices, project=self.project, region=region
+            services = self._list_outdated(self.compute_client().regionBackendServices, "regionBackendService",
+                                           "name,creationTimestamp", project=self.project, region=region)
+            deletions.extend(
+                (service, {"project": self.project, "region": region, "backendService": service["name"]}) for service in services
             )
-            self.log_dbg(f"{len(services)} region backend services found")
-            for service in services:
-                if self.is_outdated(parse(service["creationTimestamp"]).astimezone(timezone.utc)):
-                    self._delete_resource(
-                        self.compute_client().regionBackendServices, service["name"],
-                        project=self.project, region=region, backendService=service["name"]
-                    )
+        self._delete_resources(self.compute_client().regionBackendServices, "regionBackendService", deletions)
 
     def cleanup_routes(self) -> None:
         self.log_dbg("Routes cleanup")
-        routes = [
-            route for route in self._paginated(self.compute_client().routes, project=self.project)
-            if basename(route["network"]) not in self.__skip_networks
-        ]
-        self.log_dbg(f"{len(routes)} routes found")
-        for route in routes:
-            if self.is_outdated(parse(route["creationTimestamp"]).astimezone(timezone.utc)):
-                self._delete_resource(
-                    self.compute_client().routes, route["name"], project=self.project, route=route["name"]
-                )
+        routes = self._list_outdated(self.compute_client().routes, "route", "name,creationTimestamp,network",
+                                     project=self.project)
+        self._delete_resources(self.compute_client().routes, "route", [
+            (route, {"project": self.project, "route": route["name"]}) for route in routes
+        ])
 
     def cleanup_subnetworks(self) -> None:
         self.log_dbg("Subnetworks cleanup")
+        deletions = []
         for region in self.list_regions():
-            subnetworks = [
-                subnet for subnet in self._paginated(self.compute_client().subnetworks, project=self.project, region=region)
-                if basename(subnet["network"]) not in self.__skip_networks
-            ]
-            self.log_dbg(f"{len(subnetworks)} subnetworks found in region {region}")
-            for subnetwork in subnetworks:
-                if self.is_outdated(parse(subnetwork["creationTimestamp"]).astimezone(timezone.utc)):
-                    self._delete_resource(
-                        self.compute_client().subnetworks, subnetwork["name"],
-                        project=self.project, region=region, subnetwork=subnetwork["name"]
-                    )
+            subnetworks = self._list_outdated(self.compute_client().subnetworks, "subnetwork", "name,creationTimestamp,network",
+                                              project=self.project, region=region)
+            deletions.extend(
+                (subnetwork, {"project": self.project, "region": region, "subnetwork": subnetwork["name"]})
+                for subnetwork in subnetworks
+            )
+        self._delete_resources(self.compute_client().subnetworks, "subnetwork", deletions)
 
     def cleanup_networks(self) -> None:
         self.log_dbg("Networks cleanup")
-        networks = [
-            network for network in self._paginated(self.compute_client().networks, project=self.project)
-            if network["name"] not in self.__skip_networks
-        ]
-        self.log_dbg(f"{len(networks)} networks found")
-        for network in networks:
-            if self.is_outdated(parse(network["creationTimestamp"]).astimezone(timezone.utc)):
-                self._delete_resource(
-                    self.compute_client().networks, network["name"], project=self.project, network=network["name"]
-                )
+        networks = self._list_outdated(self.compute_client().networks, "network", "name,creationTimestamp",
+                                       project=self.project)
+        networks = [network for network in networks if network["name"] not in self.__skip_networks]
+        self._delete_resources(self.compute_client().networks, "network", [
+            (network, {"project": self.project, "network": network["name"]}) for network in networks
+        ])
 
     def count_all_instances(self) -> int:
         return len(self.list_all_instances())
 
     def count_all_images(self) -> int:
-        return len(self._paginated(self.compute_client().images, project=self.project))
+        return sum(1 for _ in self._iter_paginated(self.compute_client().images, fields="name", project=self.project))
 
     def count_all_disks(self) -> int:
         all_disks = 0
         for region in self.list_regions():
             for zone in self.list_zones(region):
-                all_disks += len(self._paginated(self.compute_client().disks, project=self.project, zone=zone))
+                all_disks += sum(1 for _ in self._iter_paginated(self.compute_client().disks, fields="name",
+                                                                 project=self.project, zone=zone))
         return all_disks
 
     def count_all_blobs(self) -> int:
-        return len(self._paginated(self.storage_client().objects, bucket=self.__bucket))
+        return sum(1 for _ in self._iter_paginated(self.storage_client().objects, fields="name", bucket=self.__bucket))
 
     def count_all_networks(self) -> int:
-        return len(self._paginated(self.compute_client().networks, project=self.project))
+        return sum(1 for _ in self._iter_paginated(self.compute_client().networks, fields="name", project=self.project))
@@ -7,14 +7,9 @@ from ocw.lib.k8s import clean_jobs, clean_namespaces
 
 
 class GKE(GCE):
-    __instances = {}
-
-    def __new__(cls, namespace):
-        if namespace not in GKE.__instances:
-            GKE.__instances[namespace] = self = object.__new__(cls)
-            self.__gke_client = None
-            self.__kubectl_client = {}
-        return GKE.__instances[namespace]
+    # GCE.__new__ keeps singleton per class and namespace, clients are created on first use
+    __gke_client = None
+    __kubectl_client: dict | None = None
 
     def gke_client(self):
         if self.__gke_client is None:
@@ -25,6 +20,8 @@ class GKE(GCE):
     def kubectl_client(self, zone: str, cluster: dict[str, str]):
         cluster_name = cluster["name"]
         zone_cluster = f"{zone}/{cluster_name}"
+        if self.__kubectl_client is None:
+            self.__kubectl_client = {}
         if zone_cluster not in self.__kubectl_client:
             kube_dir = "~/.kube"
             kubeconfig = f"{kube_dir}/gke_config_{zone}_{cluster_name}"
@@ -22,6 +22,7 @@ class Influx:
     IMAGE_VERSION_QUANTITY: str = "img_version_quantity"
     VPC_QUANTITY: str = "vpc_quantity"
     NETWORK_QUANTITY: str = "network_quantity"
+    DELETION_LATENCY: str = "deletion_latency"
     NAMESPACE_TAG: str = "namespace"
 
     def __init__(self) -> None:
@@ -1,4 +1,6 @@
 import os
+import threading
+import time
 from datetime import datetime
 from datetime import timedelta
 from datetime import timezone
@@ -7,10 +9,17 @@ import json
 import subprocess
 import shlex
 from pathlib import Path
+from typing import Callable
 from webui.PCWConfig import PCWConfig
 
 
 class Provider:
+    # results of expensive calls shared by all constructions of certain provider in certain namespace.
+    # key is (class name, namespace, name of cached value), value is (monotonic time of the call, result)
+    __cache: dict[tuple[str, str, str], tuple[float, object]] = {}
+    # one lock per cache key so concurrent callers wait for single loader call instead of repeating it
+    __locks: dict[tuple[str, str, str], threading.Lock] = {}
+    __locks_lock = threading.Lock()
 
     def __init__(self, namespace: str):
         self._namespace = namespace
@@ -18,6 +27,39 @@ class Provider:
         self.logger = logging.getLogger(self.__module__)
         self.auth_json = self.read_auth_json()
 
+    def cached(self, name: str, loader: Callable, ttl: int):
+        """
+            cached - returns result of loader call which is shared by all instances of this provider class
+            within same namespace and is refreshed only after it is older than ttl seconds
+        """
+        key = (self.__class__.__name__, self._namespace, name)
+        entry = Provider.__cache.get(key)
+        if entry is None or time.monotonic() - entry[0] > ttl:
+            with Provider.__locks_lock:
+                lock = Provider.__locks.setdefault(key, threading.Lock())
+            with lock:
+                # value may have been loaded by another thread while this one was waiting for the lock
+                entry = Provider.__cache.get(key)
+                if entry is None or time.monotonic() - entry[0] > ttl:
+                    entry = (time.monotonic(), loader())
+                    Provider.__cache[key] = entry
+        return entry[1]
+
+    def invalidate_cached(self, name: str) -> None:
+        Provider.__cache.pop((self.__class__.__name__, self._namespace, name), None)
+
+    def ensure_credentials(self, check: Callable) -> None:
+        """ Run credentials check only once per default/credentials_ttl seconds """
+        self.cached('credentials', check, PCWConfig.get_feature_property('default', 'credentials_ttl', self._namespace))
+
+    def cached_regions(self, loader: Callable) -> list:
+        """ Reuse list of regions for default/regions_ttl seconds """
+        return self.cached('regions', loader, PCWConfig.get_feature_property('default', 'regions_ttl', self._namespace))
+
+    @staticmethod
+    def clear_cache() -> None:
+        Provider.__cache.clear()
+
     def get_creds_location(self):
         return f'/var/pcw/{self._namespace}/{self.__class__.__name__}.json'
 
@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand
+from ocw.lib.azure import Azure
 from ocw.lib.db import update_run
 
 
@@ -7,3 +8,4 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         update_run()
+        Azure.wait_for_all_deletions()
@@ -1,5 +1,6 @@
 import pytest
 import webui
+from ocw.lib.provider import Provider
 import tempfile
 import os
 
@@ -17,3 +18,9 @@ def pcw_file():
     yield tmpFile[1]
     if os.path.exists(tmpFile[1]):
         os.remove(tmpFile[1])
+
+
+@pytest.fixture(autouse=True)
+def provider_cache():
+    yield
+    Provider.clear_cache()
@@ -16,6 +16,20 @@ def mock_get_feature_property(feature: str, property: str, namespace: str = None
         return azure_storage_resourcegroup
     elif property == 'ec2-max-age-days':
         return ec2_max_age_days
+    elif property in ('credentials_ttl', 'regions_ttl', 'ec2_list_timeout'):
+        return 3600
+    elif property in ('gce-max-workers', 'vpc-max-workers', 'azure-blob-max-workers', 'azure-gallery-max-workers'):
+        return 2
+    elif property == 'azure_max_inflight_deletes':
+        return 2
+    elif property == 'azure_lro_poll_interval':
+        return 0
+    elif property == 'azure_lro_wait_timeout':
+        return 5
+    elif property == 'azure_max_pool_connections':
+        return 20
+    elif property in ('azure_connect_timeout', 'azure_read_timeout'):
+        return 10
 
 
 def generate_model_instance(jobid_tag, created_by_tag):
@@ -31,16 +45,18 @@ def generate_model_instance(jobid_tag, created_by_tag):
     )
 
 
-class ec2_csp_instance_mock:
-    def __init__(self, tags_type):
-        if tags_type == "random":
-            tags = [{'Key': fake.uuid4(), 'Value': fake.uuid4()}]
-        elif tags_type == "empty":
-            tags = []
-        self.instance_id = fake.uuid4()
-        self.instance_type = fake.uuid4()
-        self.launch_time = datetime.now()
-        self.tags = tags
+def ec2_csp_instance_mock(tags_type):
+    if tags_type == "random":
+        tags = [{'Key': fake.uuid4(), 'Value': fake.uuid4()}]
+    elif tags_type == "empty":
+        tags = []
+    return {
+        'InstanceId': fake.uuid4(),
+        'InstanceType': fake.uuid4(),
+        'LaunchTime': datetime.now(),
+        'Tags': tags,
+        'State': 'running',
+    }
 
 
 class azure_instance_mock:
@@ -53,6 +69,7 @@ class azure_instance_mock:
             self.tags = {}
         self.name = fake.uuid4()
         self.location = fake.uuid4()
+        self.properties = None
 
 
 def gce_instance_mock(metadata_str):
@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from ocw.lib.aws import AWSClients
+from webui.PCWConfig import PCWConfig
+
+
+@pytest.fixture
+def aws_clients():
+    yield
+    AWSClients.clear()
+
+
+def test_client_shared(aws_clients):
+    client = AWSClients.client('namespace', 'ec2', 'eu-central-1', 'key', 'secret')
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        other_thread = executor.submit(AWSClients.client, 'namespace', 'ec2', 'eu-central-1', 'key', 'secret').result()
+    assert other_thread is client
+    assert AWSClients.client('namespace', 'ec2', 'us-west-2', 'key', 'secret') is not client
+    assert AWSClients.client('other', 'ec2', 'eu-central-1', 'key', 'secret') is not client
+    assert AWSClients.client('namespace', 'eks', 'eu-central-1', 'key', 'secret') is not client
+
+
+def test_resource_per_thread(aws_clients):
+    resource = AWSClients.resource('namespace', 'ec2', 'eu-central-1', 'key', 'secret')
+    assert AWSClients.resource('namespace', 'ec2', 'eu-central-1', 'key', 'secret') is resource
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        other_thread = executor.submit(AWSClients.resource, 'namespace', 'ec2', 'eu-central-1', 'key', 'secret').result()
+    assert other_thread is not resource
+
+
+def test_config(aws_clients, monkeypatch):
+    values = {
+        'aws_max_pool_connections': 42,
+        'aws_retry_mode': 'adaptive',
+        'aws_max_attempts': 7,
+        'aws_connect_timeout': 3,
+        'aws_read_timeout': 30,
+    }
+    monkeypatch.setattr(PCWConfig, 'get_feature_property', lambda feature, feature_property, namespace=None: values[feature_property])
+    config = AWSClients.client('namespace', 'ec2', 'eu-central-1', 'key', 'secret').meta.config
+    assert config.max_pool_connections == 42
+    assert config.retries['mode'] == 'adaptive'
+    assert config.connect_timeout == 3
+    assert config.read_timeout == 30
+
+
+def test_cached_client_lock_free(aws_clients):
+    client = AWSClients.client('namespace', 'ec2', 'eu-central-1', 'key', 'secret')
+    AWSClients.resource('namespace', 'ec2', 'eu-central-1', 'key', 'secret')
+    # cached client and resource are returned even while other thread creates a new client
+    with AWSClients._AWSClients__lock:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert executor.submit(AWSClients.client, 'namespace', 'ec2', 'eu-central-1', 'key', 'secret').result(timeout=5) is client
+            assert executor.submit(AWSClients.resource, 'namespace', 'ec2', 'eu-central-1', 'key', 'secret').result(timeout=5)
@@ -1,12 +1,14 @@
 from ocw.lib.azure import Azure, Provider
+from ocw.models import Instance, ProviderChoice, StateChoice
 from webui.PCWConfig import PCWConfig
 from datetime import datetime, timezone, timedelta
 from .generators import mock_get_feature_property
 from tests import generators
 from msrest.exceptions import AuthenticationError
-from azure.core.exceptions import ResourceNotFoundError
 from faker import Faker
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 
 deleted_images = list()
@@ -47,24 +49,50 @@ def bs_client_one_pcw_ignore(monkeypatch):
     monkeypatch.setattr(Azure, 'bs_client', lambda *args, **kwargs: fakeblobserviceclient)
 
 
+class FakePoller:
+    def __init__(self, done=True, error=None):
+        self.finished = threading.Event()
+        if done:
+            self.finished.set()
+        self.error = error
+
+    def done(self):
+        return self.finished.is_set()
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+
+
 class FakeResourceGroup:
     def __init__(self, name):
         self.name = name
 
 
 class FakeGallery:
-    def __init__(self, name):
+    def __init__(self, name, tags=None, resource_group="rg"):
         self.name = name
+        self.tags = tags
+        self.id = f"/subscriptions/sub/resourceGroups/{resource_group}/providers/Microsoft.Compute/galleries/{name}"
 
 
 class FakeImage:
-    def __init__(self, name):
+    def __init__(self, name, tags=None):
         self.name = name
+        self.tags = {} if tags is None else tags
+
+
+class FakePublishingProfile:
+    def __init__(self, published_date):
+        self.published_date = published_date
 
 
 class FakeVersion:
-    def __init__(self, name):
+    def __init__(self, name, published_date=None, provisioning_state="Succeeded", tags=None):
         self.name = name
+        self.publishing_profile = FakePublishingProfile(published_date or datetime.now(timezone.utc))
+        self.provisioning_state = provisioning_state
+        self.tags = tags
 
 
 @pytest.fixture
@@ -80,9 +108,9 @@ def mock_compute_mgmt_client(monkeypatch):
         client.gallery_images = lambda: None
         client.gallery_image_versions = lambda: None
 
-        client.galleries.list_by_resource_group = lambda rg: [
-            FakeGallery("gallery1"),
-            FakeGallery("gallery2")
+        client.galleries.list = lambda: [
+            FakeGallery("gallery1", resource_group="rg1"),
+            FakeGallery("gallery2", resource_group="rg1")
         ]
 
         client.gallery_images.list_by_gallery = lambda rg, gallery: {
@@ -90,12 +118,12 @@ def mock_compute_mgmt_client(monkeypatch):
             "gallery2": [FakeImage("image2")]
         }[gallery]
 
-        client.gallery_image_versions.list_by_gallery_image = lambda rg, gallery, image: {
+        client.gallery_image_versions.list_by_gallery_image = lambda rg, gallery, image: iter({
             ("rg1", "gallery1", "image1"): [FakeVersion("v1"), FakeVersion("v2"), FakeVersion("v3")],
             ("rg1", "gallery2", "image2"): [FakeVersion("v1"), FakeVersion("v2")]
-        }[(rg, gallery, image)]
+        }[(rg, gallery, image)])
 
-        client.images.begin_delete = lambda rg, name: deleted_images.append(name)
+        client.images.begin_delete = lambda rg, name: deleted_images.append(name) or FakePoller()
         return client
 
     def resource_mgmt_client(self):
@@ -122,7 +150,9 @@ class FakeGalleryAndImageDefinition:
 
 class FakeDisk:
 
-    def __init__(self, managed_by=None):
+    def __init__(self, time_created=None, name=None, managed_by=None):
+        self.time_created = datetime.now(timezone.utc) if time_created is None else time_created
+        self.name = Faker().uuid4() if name is None else name
         self.managed_by = managed_by
 
 
@@ -163,6 +193,13 @@ class FakeBlobServiceClient:
         return self.containers
 
 
+class FakeBlobDeleteResponse:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.reason = 'reason'
+
+
 class FakeContainerClient:
 
     def list_blobs(self):
@@ -170,10 +207,15 @@ class FakeContainerClient:
 
     def __init__(self, blobs):
         self.deleted_blobs = list()
+        self.batches = list()
         self.blobs = blobs
+        # status codes of blob deletions which should not succeed
+        self.failures = {}
 
-    def delete_blob(self, img_name, delete_snapshots):
-        self.deleted_blobs.append(img_name)
+    def delete_blobs(self, *blobs, delete_snapshots, raise_on_any_failure):
+        self.batches.append(list(blobs))
+        self.deleted_blobs.extend(blobs)
+        return iter([FakeBlobDeleteResponse(self.failures.get(blob, 202)) for blob in blobs])
 
 
 class FakeItem:
@@ -211,6 +253,30 @@ def test_cleanup_blob_containers_one_old_one_pcw_ignore(azure_patch, container_c
     assert container_client_one_old.deleted_blobs == ["to_be_deleted"]
 
 
+def test_cleanup_blob_container_batches(azure_patch, monkeypatch):
+    old_times = datetime.now(timezone.utc) - timedelta(hours=generators.max_age_hours+1)
+    container_client = FakeContainerClient([FakeBlob(old_times, f"blob{i}") for i in range(5)] + [FakeBlob()])
+    monkeypatch.setattr(Azure, 'container_client', lambda *args, **kwargs: container_client)
+    monkeypatch.setattr(Azure, 'BLOB_BATCH_SIZE', 2)
+    azure_patch.dry_run = False
+    azure_patch.cleanup_blob_container('sle-images')
+    assert container_client.batches == [['blob0', 'blob1'], ['blob2', 'blob3'], ['blob4']]
+
+
+def test_cleanup_blob_containers_failures_raised(azure_patch, monkeypatch):
+    monkeypatch.setattr(Azure, 'bs_client', lambda *args, **kwargs: FakeBlobServiceClient([FakeBlobContainer()]))
+    old_times = datetime.now(timezone.utc) - timedelta(hours=generators.max_age_hours+1)
+    container_client = FakeContainerClient([FakeBlob(old_times, f"blob{i}") for i in range(5)])
+    container_client.failures = {'blob1': 403, 'blob3': 404}
+    monkeypatch.setattr(Azure, 'container_client', lambda *args, **kwargs: container_client)
+    monkeypatch.setattr(Azure, 'BLOB_BATCH_SIZE', 2)
+    azure_patch.dry_run = False
+    with pytest.raises(RuntimeError, match=r"Deletion of 1 blobs in container .* failed: blob1 \(403 reason\)"):
+        azure_patch.cleanup_blob_containers()
+    # failure doesn't stop following batches and already deleted blob is not a failure
+    assert container_client.batches == [['blob0', 'blob1'], ['blob2', 'blob3'], ['blob4']]
+
+
 def test_cleanup_blob_containers_all_new_one_pcw_ignore(azure_patch, container_client_all_new, bs_client_one_pcw_ignore):
     azure_patch.cleanup_blob_containers()
     assert container_client_all_new.deleted_blobs == []
@@ -236,47 +302,37 @@ def test_cleanup_images_one_old(azure_patch, monkeypatch, mock_compute_mgmt_clie
     assert deleted_images[0] == "to_delete"
 
 
-def test_cleanup_disks_all_new(azure_patch, monkeypatch):
-
+@pytest.fixture
+def mock_disks(monkeypatch):
     global deleted_images
     # to make sure that we not failing due to other test left dirty env.
     deleted_images = list()
+    disks = []
 
     def mock_compute_mgmt_client(self):
         def compute_mgmt_client():
             pass
 
         compute_mgmt_client.disks = lambda: None
-        compute_mgmt_client.disks.begin_delete = lambda rg, name: deleted_images.append(name)
-        compute_mgmt_client.disks.get = lambda rg, name: FakeDisk()
+        compute_mgmt_client.disks.begin_delete = lambda rg, name: deleted_images.append(name) or FakePoller()
+        compute_mgmt_client.disks.list_by_resource_group = lambda rg: iter(disks)
+        compute_mgmt_client.disks.get = lambda rg, name: pytest.fail("disks.get should not be called")
         return compute_mgmt_client
 
     monkeypatch.setattr(Azure, 'compute_mgmt_client', mock_compute_mgmt_client)
+    return disks
 
-    monkeypatch.setattr(Azure, 'list_resource', lambda *args, **kwargs: [FakeItem(), FakeItem()])
+
+def test_cleanup_disks_all_new(azure_patch, mock_disks):
+    mock_disks.extend([FakeDisk(), FakeDisk()])
     azure_patch.cleanup_disks()
 
     assert len(deleted_images) == 0
 
 
-def test_cleanup_disks_one_old_no_managed_by(azure_patch, monkeypatch):
-    global deleted_images
-    # to make sure that we not failing due to other test left dirty env.
-    deleted_images = list()
-
-    def mock_compute_mgmt_client(self):
-        def compute_mgmt_client():
-            pass
-
-        compute_mgmt_client.disks = lambda: None
-        compute_mgmt_client.disks.begin_delete = lambda rg, name: deleted_images.append(name)
-        compute_mgmt_client.disks.get = lambda rg, name: FakeDisk()
-        return compute_mgmt_client
-
-    monkeypatch.setattr(Azure, 'compute_mgmt_client', mock_compute_mgmt_client)
-
+def test_cleanup_disks_one_old_no_managed_by(azure_patch, mock_disks):
     old_times = datetime.now(timezone.utc) - timedelta(hours=generators.max_age_hours+1)
-    monkeypatch.setattr(Azure, 'list_resource', lambda *args, **kwargs: [FakeItem(old_times, "to_delete"), FakeItem()])
+    mock_disks.extend([FakeDisk(old_times, "to_delete"), FakeDisk()])
     azure_patch.dry_run = True
     azure_patch.cleanup_disks()
     assert len(deleted_images) == 0
@@ -287,24 +343,9 @@ def test_cleanup_disks_one_old_no_managed_by(azure_patch, monkeypatch):
     assert deleted_images[0] == "to_delete"
 
 
-def test_cleanup_disks_one_old_with_managed_by(azure_patch, monkeypatch):
-    global deleted_images
-    # to make sure that we not failing due to other test left dirty env.
-    deleted_images = list()
-
-    def mock_compute_mgmt_client(self):
-        def compute_mgmt_client():
-            pass
-
-        compute_mgmt_client.disks = lambda: None
-        compute_mgmt_client.disks.begin_delete = lambda rg, name: deleted_images.append(name)
-        compute_mgmt_client.disks.get = lambda rg, name: FakeDisk("I am busy")
-        return compute_mgmt_client
-
-    monkeypatch.setattr(Azure, 'compute_mgmt_client', mock_compute_mgmt_client)
-
+def test_cleanup_disks_one_old_with_managed_by(azure_patch, mock_disks):
     old_times = datetime.now(timezone.utc) - timedelta(hours=generators.max_age_hours+1)
-    monkeypatch.setattr(Azure, 'list_resource', lambda *args, **kwargs: [FakeItem(old_times, "to_delete"), FakeItem()])
+    mock_disks.extend([FakeDisk(old_times, "to_delete", managed_by="I am busy"), FakeDisk()])
     azure_patch.cleanup_disks()
 
     assert len(deleted_images) == 0
@@ -333,14 +374,22 @@ def test_check_credentials(monkeypatch):
     count_list_resource_groups = 0
     failed_list_resource_groups = 0
 
-    def mock_list_resource_groups(self):
+    def mock_list_resource_groups(top=None):
         nonlocal count_list_resource_groups
+        assert top == 1
         count_list_resource_groups = count_list_resource_groups + 1
         if count_list_resource_groups > failed_list_resource_groups:
-            return True
+            return [FakeResourceGroup("rg1")]
         raise AuthenticationError("OHA Mocked auth error")
 
-    monkeypatch.setattr(Azure, 'list_resource_groups', mock_list_resource_groups)
+    def resource_mgmt_client(self):
+        def client():
+            pass
+        client.resource_groups = lambda: None
+        client.resource_groups.list = mock_list_resource_groups
+        return client
+
+    monkeypatch.setattr(Azure, 'resource_mgmt_client', resource_mgmt_client)
     monkeypatch.setattr(time, 'sleep', lambda *args, **kwargs: True)
     monkeypatch.setattr(Provider, 'read_auth_json', lambda *args, **
                         kwargs: {'client_id': 'fake'})
@@ -351,12 +400,50 @@ def test_check_credentials(monkeypatch):
     Azure('fake')
     assert count_list_resource_groups == 4
 
+    # credentials are validated only once per credentials_ttl
+    count_list_resource_groups = 0
+    Azure('fake')
+    assert count_list_resource_groups == 0
+
+    Provider.clear_cache()
     count_list_resource_groups = 0
     failed_list_resource_groups = 5
     with pytest.raises(AuthenticationError):
         Azure('fake')
 
 
+def test_mgmt_clients_shared(azure_patch, monkeypatch):
+    monkeypatch.setattr(Provider, 'get_data', lambda self, name=None: '00000000-0000-0000-0000-000000000000')
+    azure = Azure('shared_clients')
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        clients = list(executor.map(lambda _: azure.compute_mgmt_client(), range(4)))
+    assert all(client is clients[0] for client in clients)
+    assert azure.resource_mgmt_client().resource_groups is not None
+    transport = azure.transport()
+    assert transport.session is azure.transport().session
+    assert transport.session.get_adapter('https://management.azure.com')._pool_maxsize == 20
+
+
+def test_iter_resource_groups(azure_patch, monkeypatch):
+    filters = []
+
+    def resource_mgmt_client(self):
+        def client():
+            pass
+        client.resource_groups = lambda: None
+        client.resource_groups.list = lambda filter=None: filters.append(filter) or [FakeResourceGroup("rg1")]
+        return client
+
+    monkeypatch.setattr(Azure, 'resource_mgmt_client', resource_mgmt_client)
+    assert [rg.name for rg in azure_patch.iter_resource_groups()] == ["rg1"]
+    assert filters == [None]
+
+    monkeypatch.setattr(PCWConfig, 'get_feature_property', lambda feature, feature_property, namespace=None:
+                        "tagName eq 'openqa_created_by'" if feature_property == 'azure_resource_group_filter' else None)
+    assert [rg.name for rg in azure_patch.iter_resource_groups()] == ["rg1"]
+    assert filters == [None, "tagName eq 'openqa_created_by'"]
+
+
 def test_container_valid_for_cleanup():
     assert Azure.container_valid_for_cleanup(FakeBlobContainer({}, "random name")) is False
     assert Azure.container_valid_for_cleanup(FakeBlobContainer({}, "sle-images")) is True
@@ -365,11 +452,9 @@ def test_container_valid_for_cleanup():
     assert Azure.container_valid_for_cleanup(FakeBlobContainer({"pcw_ignore": "1"}, "sle-images")) is False
 
 
-def test_get_vm_types_in_resource_group(azure_patch, monkeypatch):
+def test_get_vm_types_by_resource_group(azure_patch, monkeypatch):
     azure = Azure('fake')
 
-    vms_list = list()
-
     class MockedHWProfile:
 
         def __init__(self, vmtype):
@@ -377,55 +462,201 @@ def test_get_vm_types_in_resource_group(azure_patch, monkeypatch):
 
     class MockVM:
 
-        def __init__(self, vmtype):
+        def __init__(self, resource_group, vmtype):
+            self.id = f"/subscriptions/sub/resourceGroups/{resource_group}/providers/Microsoft.Compute/virtualMachines/vm"
             self.hardware_profile = MockedHWProfile(vmtype)
 
-    def mocked_list(name):
-        if name == 'fire!!!':
-            raise ResourceNotFoundError
-        else:
-            return vms_list
+    vms_list = [MockVM('RG1', 'fake'), MockVM('rg1', 'fake'), MockVM('rg1', 'anotherfake'), MockVM('rg2', 'fake')]
+    monkeypatch.setattr(Azure, 'list_instances', lambda self: vms_list)
 
-    def mock_compute_mgmt_client(self):
-        def compute_mgmt_client():
-            pass
+    vm_types = azure.get_vm_types_by_resource_group()
+    # group names are case insensitive and every type is mentioned once
+    assert set(vm_types) == {'rg1', 'rg2'}
+    assert sorted(vm_types['rg1'].split(', ')) == ['anotherfake', 'fake']
+    assert vm_types['rg2'] == 'fake'
 
-        compute_mgmt_client.virtual_machines = lambda: None
-        compute_mgmt_client.virtual_machines.list = mocked_list
-        return compute_mgmt_client
 
-    monkeypatch.setattr(Azure, 'compute_mgmt_client', mock_compute_mgmt_client)
+def test_get_vm_types_in_resource_group():
+    class MockedProperties:
 
-    # when there is no VMs we returning 'N/A'
-    ret = azure.get_vm_types_in_resource_group('fake')
-    assert ret == 'N/A'
+        def __init__(self, provisioning_state):
+            self.provisioning_state = provisioning_state
 
-    vms_list.append(MockVM('fake'))
+    class MockedResourceGroup:
 
-    # when single VM is in the list we returning name of type of this VM
-    ret = azure.get_vm_types_in_resource_group('fake')
-    assert ret == 'fake'
+        def __init__(self, name, provisioning_state='Succeeded'):
+            self.name = name
+            self.properties = MockedProperties(provisioning_state)
 
-    vms_list.append(MockVM('fake'))
+    vm_types = {'rg1': 'fake'}
+    assert Azure.get_vm_types_in_resource_group(MockedResourceGroup('RG1'), vm_types) == 'fake'
+    # when there is no VMs we returning 'N/A'
+    assert Azure.get_vm_types_in_resource_group(MockedResourceGroup('empty'), vm_types) == 'N/A'
+    # group which is already being deleted is handled as already deleted one
+    assert Azure.get_vm_types_in_resource_group(MockedResourceGroup('rg1', 'Deleting'), vm_types) is None
 
-    # now there are two VMs with same type but we returning same string
-    # because we don't want to duplicate same type again
-    ret = azure.get_vm_types_in_resource_group('fake')
-    assert ret == 'fake'
 
-    vms_list.append(MockVM('anotherfake'))
+def test_cleanup_gallery_img_versions(azure_patch, monkeypatch):
+    old_times = datetime.now(timezone.utc) - timedelta(hours=generators.max_age_hours+1)
+    versions = {
+        "image1": [FakeVersion("old", old_times), FakeVersion("new"), FakeVersion("failed", provisioning_state="Failed"),
+                   FakeVersion("ignored", old_times, tags={Instance.TAG_IGNORE: "1"})],
+        "image2": [],
+        "image3": [FakeVersion("old", old_times)],
+    }
+    deleted = []
 
-    # now we have two VMs with same type and 3d with different one
-    ret = azure.get_vm_types_in_resource_group('fake')
-    assert 'anotherfake' in ret
-    assert 'fake' in ret
+    def compute_mgmt_client(self):
+        def client():
+            pass
+        client.galleries = lambda: None
+        client.gallery_images = lambda: None
+        client.gallery_image_versions = lambda: None
+        client.galleries.get = lambda rg, gallery: FakeGallery(gallery, {})
+        client.gallery_images.list_by_gallery = lambda rg, gallery: [
+            FakeImage("image1"), FakeImage("image2"), FakeImage("image3", {Instance.TAG_IGNORE: "1"})]
+        client.gallery_images.begin_delete = lambda rg, gallery, image: deleted.append(image) or FakePoller()
+        client.gallery_image_versions.list_by_gallery_image = lambda rg, gallery, image: iter(versions[image])
+        client.gallery_image_versions.begin_delete = \
+            lambda rg, gallery, image, version: deleted.append(f"{image}/{version}") or FakePoller()
+        return client
 
-    vms_list.append(MockVM('fake'))
+    monkeypatch.setattr(Azure, 'compute_mgmt_client', compute_mgmt_client)
+    monkeypatch.setattr(Azure, 'get_resource_properties', lambda *args: pytest.fail("per version get should not be called"))
+    azure_patch.dry_run = True
+    azure_patch.cleanup_gallery_img_versions()
+    assert deleted == []
 
-    # when one of VMs throw azure.core.exceptions.ResourceNotFoundError we returning None
-    ret = azure.get_vm_types_in_resource_group('fire!!!')
-    assert ret is None
+    azure_patch.dry_run = False
+    azure_patch.cleanup_gallery_img_versions()
+    assert sorted(deleted) == ["image1/failed", "image1/old", "image2"]
 
 
 def test_get_img_versions_count(azure_patch, mock_compute_mgmt_client):
     assert Azure('fake').get_img_versions_count() == 5
+
+
+def test_count_gallery_img_versions(azure_patch, mock_compute_mgmt_client):
+    assert Azure('fake').count_gallery_img_versions() == {"rg1/gallery1": 3, "rg1/gallery2": 2}
+
+
+def test_count_gallery_img_versions_two_phases(azure_patch, mock_compute_mgmt_client, monkeypatch):
+    calls = []
+
+    def list_gallery_images(self, resource_group, gallery_name):
+        calls.append(gallery_name)
+        if gallery_name == "gallery1":
+            raise RuntimeError("listing failed")
+        return ["image2", "image3"]
+
+    def count_image_versions(self, resource_group, gallery_name, image_name):
+        calls.append(image_name)
+        return 2
+
+    monkeypatch.setattr(Azure, 'list_gallery_images', list_gallery_images)
+    monkeypatch.setattr(Azure, 'count_image_versions', count_image_versions)
+    # failed gallery is skipped and images of all galleries are listed before any versions are counted
+    assert Azure('fake').count_gallery_img_versions() == {"rg1/gallery2": 4}
+    assert set(calls[:2]) == {"gallery1", "gallery2"}
+    assert sorted(calls[2:]) == ["image2", "image3"]
+
+
+def test_deletions_on_done(azure_patch):
+    finished = []
+    azure_patch.deletions.submit("ok", lambda name: FakePoller(), "ok", on_done=lambda: finished.append("ok"))
+    azure_patch.deletions.submit("failed", lambda name: FakePoller(error=Exception("boom")), "failed",
+                                 on_done=lambda: finished.append("failed"))
+    azure_patch.deletions.wait(5)
+    assert finished == ["ok"]
+    assert azure_patch.deletions.pending() == 0
+
+
+def test_deletions_inflight_limit(azure_patch):
+    # mock_get_feature_property allows 2 deletions in flight
+    pollers = [FakePoller(done=False) for _ in range(3)]
+    started = []
+
+    def begin_delete(i):
+        started.append(i)
+        return pollers[i]
+
+    for i in range(3):
+        azure_patch.deletions.submit(f"rg{i}", begin_delete, i)
+    # third deletion is queued without blocking the caller
+    assert started == [0, 1]
+    assert azure_patch.deletions.pending() == 3
+    pollers[0].finished.set()
+    for _ in range(500):
+        if len(started) == 3:
+            break
+        time.sleep(0.01)
+    assert started == [0, 1, 2]
+    pollers[1].finished.set()
+    pollers[2].finished.set()
+    azure_patch.deletions.wait(5)
+    assert azure_patch.deletions.pending() == 0
+
+
+def test_deletions_refused_when_not_queued(azure_patch):
+    pollers = [FakePoller(done=False) for _ in range(3)]
+    assert azure_patch.deletions.submit("rg0", lambda: pollers[0])
+    assert azure_patch.deletions.submit("rg1", lambda: pollers[1])
+    assert not azure_patch.deletions.submit("rg2", lambda: pollers[2], queue=False)
+    assert azure_patch.deletions.pending() == 2
+    assert azure_patch.deletions.queued() == 0
+    for poller in pollers[:2]:
+        poller.finished.set()
+    azure_patch.deletions.wait(5)
+
+
+def test_delete_resource_over_limit(azure_patch, monkeypatch):
+    pollers = []
+
+    class ResourceGroups:
+        @staticmethod
+        def begin_delete(resource_id):
+            pollers.append(FakePoller(done=False))
+            return pollers[-1]
+
+    monkeypatch.setattr(Azure, 'resource_mgmt_client', lambda self: type('Client', (), {'resource_groups': ResourceGroups}))
+    azure_patch.dry_run = False
+    assert azure_patch.delete_resource('rg1')
+    assert azure_patch.delete_resource('rg2')
+    # third resource group is neither started nor queued
+    assert not azure_patch.delete_resource('rg3')
+    assert len(pollers) == 2
+    for poller in pollers:
+        poller.finished.set()
+    azure_patch.deletions.wait(5)
+
+
+def test_wait_for_all_deletions(azure_patch, caplog):
+    # mock_get_feature_property allows 2 deletions in flight and waits 5 seconds for them
+    poller = FakePoller(done=False)
+    stuck = [FakePoller(done=False) for _ in range(2)]
+    azure_patch.deletions.submit("image", lambda: poller)
+    threading.Timer(0.2, poller.finished.set).start()
+    Azure.wait_for_all_deletions()
+    assert azure_patch.deletions.pending() == 0
+
+    for i, stuck_poller in enumerate(stuck):
+        azure_patch.deletions.submit(f"disk{i}", lambda p=stuck_poller: p)
+    azure_patch.deletions.submit("disk2", FakePoller)
+    azure_patch.wait_for_deletions(0)
+    # queued deletion is reported separately from started ones which did not finish
+    assert "1 deletions were never started" in caplog.text
+    assert "2 deletions did not finish in time" in caplog.text
+    for stuck_poller in stuck:
+        stuck_poller.finished.set()
+    azure_patch.deletions.wait(5)
+
+
+@pytest.mark.django_db
+def test_mark_deleted(azure_patch):
+    now = datetime.now(timezone.utc)
+    for namespace in ('fake', 'other'):
+        Instance.objects.create(provider=ProviderChoice.AZURE, instance_id='rg1', namespace=namespace, first_seen=now,
+                                last_seen=now, state=StateChoice.DELETING)
+    azure_patch.mark_deleted('rg1')
+    assert Instance.objects.get(namespace='fake').state == StateChoice.DELETED
+    assert Instance.objects.get(namespace='other').state == StateChoice.DELETING
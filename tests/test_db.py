@@ -1,5 +1,6 @@
 from os.path import basename
 from ocw.lib.db import update_run, ec2_extract_data, gce_extract_data, azure_extract_data, delete_instance, reset_stale_deleting
+from ocw.lib.db import sync_instances, auto_delete_instances
 from webui.PCWConfig import PCWConfig
 from faker import Faker
 from tests.generators import ec2_csp_instance_mock, gce_instance_mock, azure_instance_mock
@@ -8,7 +9,9 @@ from ocw.lib.gce import GCE
 from ocw.lib.azure import Azure
 from ocw.lib.ec2 import EC2
 import json
-from django.db import transaction
+import threading
+from django.db import transaction, connection
+from django.test.utils import CaptureQueriesContext
 import pytest
 import dateutil.parser as dateparser
 from datetime import datetime, timezone, timedelta
@@ -17,11 +20,8 @@ fake = Faker()
 
 
 class AzureMock:
-    def get_vm_types_in_resource_group(self, name):
-        return name
-
     def delete_resource(self, id):
-        pass
+        return True
 
 
 class EC2Mock:
@@ -78,8 +78,8 @@ def extract_data():
 
 
 @pytest.fixture
-def azure_fixture(monkeypatch, extract_data):
-    monkeypatch.setattr(Azure, '__new__', lambda cls, namespace: AzureMock())
+def azure_fixture(extract_data):
+    extract_data['vm_types'] = {}
     return extract_data
 
 
@@ -89,13 +89,13 @@ def test_ec2_extract_data(extract_data):
     rez = ec2_extract_data(csp_instance, extract_data['namespace'],
                            extract_data['region'], extract_data['default_ttl'])
 
-    assert csp_instance.tags[0]['Key'] in rez['tags']
-    assert rez['id'] == csp_instance.instance_id
-    assert rez['first_seen'] == csp_instance.launch_time
+    assert csp_instance['Tags'][0]['Key'] in rez['tags']
+    assert rez['id'] == csp_instance['InstanceId']
+    assert rez['first_seen'] == csp_instance['LaunchTime']
     assert rez['namespace'] == extract_data['namespace']
     assert rez['region'] == extract_data['region']
     assert rez['provider'] == ProviderChoice.EC2
-    assert rez['type'] == csp_instance.instance_type
+    assert rez['type'] == csp_instance['InstanceType']
     assert rez['default_ttl'] == extract_data['default_ttl']
 
 
@@ -151,7 +151,8 @@ def test_gce_extract_data_metadata_empty(extract_data):
 def test_azure_extract_data(azure_fixture):
 
     csp_instance = azure_instance_mock("openqa_created_date")
-    rez = azure_extract_data(csp_instance, azure_fixture['namespace'], azure_fixture['default_ttl'])
+    azure_fixture['vm_types'][csp_instance.name.lower()] = 'Standard_B1s'
+    rez = azure_extract_data(csp_instance, azure_fixture['namespace'], azure_fixture['default_ttl'], azure_fixture['vm_types'])
 
     assert csp_instance.tags == rez['tags']
     assert rez['id'] == csp_instance.name
@@ -159,14 +160,14 @@ def test_azure_extract_data(azure_fixture):
     assert rez['namespace'] == azure_fixture['namespace']
     assert rez['region'] == csp_instance.location
     assert rez['provider'] == ProviderChoice.AZURE
-    assert rez['type'] == csp_instance.name
+    assert rez['type'] == 'Standard_B1s'
     assert rez['default_ttl'] == azure_fixture['default_ttl']
 
 
 def test_azure_extract_data_no_created_date(azure_fixture):
 
     csp_instance = azure_instance_mock("random")
-    rez = azure_extract_data(csp_instance, azure_fixture['namespace'], azure_fixture['default_ttl'])
+    rez = azure_extract_data(csp_instance, azure_fixture['namespace'], azure_fixture['default_ttl'], azure_fixture['vm_types'])
 
     assert (datetime.now(timezone.utc) - rez['first_seen']).days == 0
 
@@ -174,9 +175,10 @@ def test_azure_extract_data_no_created_date(azure_fixture):
 def test_azure_extract_data_no_tags(azure_fixture):
 
     csp_instance = azure_instance_mock("no_tags")
-    rez = azure_extract_data(csp_instance, azure_fixture['namespace'], azure_fixture['default_ttl'])
+    rez = azure_extract_data(csp_instance, azure_fixture['namespace'], azure_fixture['default_ttl'], azure_fixture['vm_types'])
 
     assert rez['tags'] == {}
+    assert rez['type'] == 'N/A'
 
 
 def test_update_run(update_run_patch, monkeypatch):
@@ -339,6 +341,138 @@ def test_reset_stale_deleting(monkeypatch):
             assert instance.deleting_since == case['deleting_since'], f"deleting_since should remain unchanged for {case['desc']}"
 
 
+def test_update_run_providers_in_parallel(update_run_patch, monkeypatch):
+    call_stack = []
+    # each provider sync blocks until the other one is running as well
+    barrier = threading.Barrier(2, timeout=5)
+
+    def mocked__update_provider(provider, namespace, default_ttl):
+        barrier.wait()
+        if provider == 'provider2':
+            raise Exception
+
+    monkeypatch.setattr(PCWConfig, 'get_providers_for', lambda namespace, region: ['provider1', 'provider2'])
+    monkeypatch.setattr('ocw.lib.db._update_provider', mocked__update_provider)
+    monkeypatch.setattr('ocw.lib.db.reset_stale_deleting', lambda: call_stack.append('reset_stale_deleting'))
+    monkeypatch.setattr('ocw.lib.db.auto_delete_instances', lambda: call_stack.append('auto_delete_instances'))
+    monkeypatch.setattr('ocw.lib.db.send_mail', lambda subject, body: call_stack.append(subject))
+
+    update_run()
+
+    assert call_stack == ['Error on update provider2 in namespace namespace1', 'reset_stale_deleting', 'auto_delete_instances']
+
+
+def csp_data_mock(instance_id, provider=ProviderChoice.EC2, namespace='namespace1', region='region1', instance_type='type1'):
+    return {
+        'tags': {'openqa_ttl': '3600'},
+        'id': instance_id,
+        'first_seen': datetime.now(tz=timezone.utc) - timedelta(minutes=5),
+        'namespace': namespace,
+        'region': region,
+        'provider': provider,
+        'type': instance_type,
+        'default_ttl': 1111
+    }
+
+
+@pytest.mark.django_db
+def test_sync_instances():
+    sync_instances('EC2', 'namespace1', [csp_data_mock('keep'), csp_data_mock('vanish')])
+    assert Instance.objects.filter(namespace='namespace1').count() == 2
+    assert Instance.objects.get(instance_id='keep').state == StateChoice.ACTIVE
+
+    updated = csp_data_mock('keep', region='region2')
+    updated['tags']['openqa_var_job_id'] = '42'
+    sync_instances('EC2', 'namespace1', [updated, csp_data_mock('new')])
+
+    keep = Instance.objects.get(instance_id='keep')
+    assert keep.active
+    assert keep.region == 'region2'
+    assert keep.cspinfo.get_tag('openqa_var_job_id') == '42'
+    assert keep.ttl == timedelta(seconds=3600)
+    vanish = Instance.objects.get(instance_id='vanish')
+    assert not vanish.active
+    assert vanish.state == StateChoice.DELETED
+    new = Instance.objects.get(instance_id='new')
+    assert new.active
+    assert new.cspinfo.type == 'type1'
+
+
+@pytest.mark.django_db
+def test_sync_instances_azure_group_already_deleted():
+    sync_instances('AZURE', 'namespace1', [csp_data_mock('gone', provider=ProviderChoice.AZURE, instance_type=None)])
+    assert not Instance.objects.filter(instance_id='gone').exists()
+
+
+@pytest.mark.django_db
+def test_sync_instances_constant_queries():
+    with CaptureQueriesContext(connection) as few:
+        sync_instances('EC2', 'namespace1', [csp_data_mock(f'few{i}') for i in range(2)])
+    with CaptureQueriesContext(connection) as many:
+        sync_instances('EC2', 'namespace2', [csp_data_mock(f'many{i}', namespace='namespace2') for i in range(50)])
+    assert len(few.captured_queries) == len(many.captured_queries)
+
+    with CaptureQueriesContext(connection) as update:
+        sync_instances('EC2', 'namespace2', [csp_data_mock(f'many{i}', namespace='namespace2') for i in range(50)])
+    assert len(update.captured_queries) <= len(many.captured_queries) + 2
+
+
+@pytest.mark.django_db
+def test_auto_delete_instances_ec2_batched(monkeypatch):
+    terminate_calls = []
+    mails = []
+
+    class EC2BatchMock:
+        def delete_instances(self, region, instance_ids):
+            terminate_calls.append((region, sorted(instance_ids)))
+            return {'failing': ValueError('failing')} if 'failing' in instance_ids else {}
+
+    monkeypatch.setattr(EC2, '__new__', lambda cls, namespace: EC2BatchMock())
+    monkeypatch.setattr(PCWConfig, 'get_namespaces_for', lambda feature: ['namespace1'])
+    monkeypatch.setattr('ocw.lib.db.send_mail', lambda subject, body: mails.append(body))
+    now = datetime.now(tz=timezone.utc)
+    for instance_id, region in (('i1', 'region1'), ('i2', 'region1'), ('failing', 'region1'), ('i3', 'region2')):
+        instance = Instance.objects.create(provider=ProviderChoice.EC2, instance_id=instance_id, region=region,
+                                           namespace='namespace1', first_seen=now, last_seen=now, active=True,
+                                           state=StateChoice.ACTIVE, age=timedelta(hours=2), ttl=timedelta(hours=1))
+        CspInfo.objects.create(instance=instance, tags='{}', type='type1')
+
+    auto_delete_instances()
+
+    assert sorted(terminate_calls) == [('region1', ['failing', 'i1', 'i2']), ('region2', ['i3'])]
+    assert set(Instance.objects.filter(state=StateChoice.DELETING).values_list('instance_id', flat=True)) == {'i1', 'i2', 'i3'}
+    assert Instance.objects.get(instance_id='failing').state == StateChoice.ACTIVE
+    assert len(mails) == 1 and 'failing' in mails[0]
+
+
+@pytest.mark.django_db
+def test_auto_delete_instances_azure_postponed(monkeypatch):
+    calls = []
+
+    class AzurePostponingMock:
+        # no wait_for_deletions, scheduler must not be blocked by running deletions
+        def delete_resource(self, resource_id):
+            calls.append(resource_id)
+            # second deletion is over default/azure_max_inflight_deletes
+            return resource_id == 'rg1'
+
+    monkeypatch.setattr(Azure, '__new__', lambda cls, namespace: AzurePostponingMock())
+    monkeypatch.setattr(PCWConfig, 'get_namespaces_for', lambda feature: ['namespace1'])
+    now = datetime.now(tz=timezone.utc)
+    for instance_id in ('rg1', 'rg2'):
+        instance = Instance.objects.create(provider=ProviderChoice.AZURE, instance_id=instance_id, namespace='namespace1',
+                                           first_seen=now, last_seen=now, active=True, state=StateChoice.ACTIVE,
+                                           age=timedelta(hours=2), ttl=timedelta(hours=1))
+        CspInfo.objects.create(instance=instance, tags='{}', type='type1')
+
+    auto_delete_instances()
+
+    assert sorted(calls) == ['rg1', 'rg2']
+    assert Instance.objects.get(instance_id='rg1').state == StateChoice.DELETING
+    # postponed deletion stays ACTIVE so next update run issues it again
+    assert Instance.objects.get(instance_id='rg2').state == StateChoice.ACTIVE
+
+
 def test_update_run_update_provider_throw_exception(update_run_patch, monkeypatch):
 
     call_stack = []
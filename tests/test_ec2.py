@@ -6,6 +6,9 @@ from faker import Faker
 from datetime import datetime, timezone, timedelta
 from botocore.exceptions import ClientError
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
 
 older_than_max_age_date = datetime.now(timezone.utc) - timedelta(days=ec2_max_age_days + 1)
 older_than_max_age_str = older_than_max_age_date.strftime("%m/%d/%Y, %H:%M:%S")
@@ -70,13 +73,18 @@ def ec2_patch_for_vpc(ec2_patch, monkeypatch):
         # within emailnotify.send_mail we needs sane strings
         if feature == 'notify' and property in ('to', 'from'):
             return 'email'
+        elif property == 'vpc-max-workers':
+            return 2
         else:
             return -1
 
     MockedEC2Client.response = {
         'Vpcs': [
             {'VpcId': 'someId', 'OwnerId': 'someId'}
-        ]
+        ],
+        'Reservations': [],
+        'VpcEndpoints': [],
+        'VpcPeeringConnections': [],
     }
     monkeypatch.setattr(PCWConfig, 'getBoolean', mocked_get_boolean)
     monkeypatch.setattr(PCWConfig, 'has', mocked_has)
@@ -85,8 +93,21 @@ def ec2_patch_for_vpc(ec2_patch, monkeypatch):
     return EC2('fake')
 
 
+class MockedPaginator:
+    def __init__(self, operation):
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        MockedEC2Client.paginate_calls.append((self.operation, kwargs))
+        return [MockedEC2Client.response]
+
+
 class MockedEC2Client():
     response = {}
+    paginate_calls = list()
+    terminate_calls = list()
+    missing_instances = set()
+    broken_instance = None
     deleted_images = list()
     deleted_volumes = list()
     deleted_keys = list()
@@ -131,6 +152,9 @@ class MockedEC2Client():
 
     ec2_snapshots = {snapshotid_to_delete: 'snapshot', snapshotid_i_have_ami: 'snapshot'}
 
+    def get_paginator(self, operation):
+        return MockedPaginator(operation)
+
     def describe_images(self, *args, **kwargs):
         return MockedEC2Client.response
 
@@ -150,6 +174,15 @@ class MockedEC2Client():
         else:
             MockedEC2Client.ec2_snapshots.pop(SnapshotId, None)
 
+    def terminate_instances(self, InstanceIds):
+        MockedEC2Client.terminate_calls.append(list(InstanceIds))
+        missing = [i for i in InstanceIds if i in MockedEC2Client.missing_instances]
+        if missing:
+            message = f"The instance IDs '{', '.join(missing)}' do not exist"
+            raise ClientError({'Error': {'Code': 'InvalidInstanceID.NotFound', 'Message': message}}, 'TerminateInstances')
+        if MockedEC2Client.broken_instance in InstanceIds:
+            raise ClientError({'Error': {'Code': 'OperationNotPermitted', 'Message': 'protected'}}, 'TerminateInstances')
+
     def delete_volume(self, VolumeId):
         MockedEC2Client.deleted_volumes.append(VolumeId)
 
@@ -351,6 +384,47 @@ def test_cleanup_volumes_cleanupcheck(ec2_patch):
     assert MockedEC2Client.deleted_volumes[0] == MockedEC2Client.volumeid_to_delete
 
 
+def test_delete_instances(ec2_patch):
+    MockedEC2Client.terminate_calls = list()
+    MockedEC2Client.missing_instances = {'i-0002', 'i-0003'}
+    MockedEC2Client.broken_instance = 'i-0005'
+    ec2_patch.dry_run = False
+    failed = ec2_patch.delete_instances('region1', ['i-0001', 'i-0002', 'i-0003', 'i-0004', 'i-0005'])
+    assert list(failed) == ['i-0005']
+    assert MockedEC2Client.terminate_calls == [
+        ['i-0001', 'i-0002', 'i-0003', 'i-0004', 'i-0005'],
+        # not existing instances are removed from the batch
+        ['i-0001', 'i-0004', 'i-0005'],
+        # other errors are resolved per instance
+        ['i-0001'], ['i-0004'], ['i-0005'],
+    ]
+    MockedEC2Client.terminate_calls = list()
+    ec2_patch.dry_run = True
+    assert ec2_patch.delete_instances('region1', ['i-0001']) == {}
+    assert MockedEC2Client.terminate_calls == []
+    MockedEC2Client.missing_instances = set()
+    MockedEC2Client.broken_instance = None
+
+
+def test_delete_instances_batch_size(ec2_patch, monkeypatch):
+    MockedEC2Client.terminate_calls = list()
+    monkeypatch.setattr(EC2, 'TERMINATE_BATCH_SIZE', 2)
+    ec2_patch.dry_run = False
+    ec2_patch.delete_instances('region1', ['i-1', 'i-2', 'i-3'])
+    assert MockedEC2Client.terminate_calls == [['i-1', 'i-2'], ['i-3']]
+
+
+def test_cleanup_snapshots_volumes_server_side_filters(ec2_patch):
+    MockedEC2Client.paginate_calls = list()
+    MockedEC2Client.response = {'Snapshots': [], 'Volumes': []}
+    ec2_patch.cleanup_snapshots(ec2_max_age_days)
+    ec2_patch.cleanup_volumes(ec2_max_age_days)
+    assert MockedEC2Client.paginate_calls == [
+        ('describe_snapshots', {'OwnerIds': ['self'], 'Filters': [{'Name': 'status', 'Values': ['completed', 'error']}]}),
+        ('describe_volumes', {'Filters': [{'Name': 'status', 'Values': ['available']}]}),
+    ]
+
+
 def test_cleanup_uploader_vpc_no_mail_sent_due_dry_run(ec2_patch_for_vpc):
     MockedSMTP.mimetext = ''
     ec2_patch_for_vpc.dry_run = True
@@ -391,11 +465,42 @@ def test_delete_vpc_deleting_everything(ec2_patch, monkeypatch):
     monkeypatch.setattr(EC2, 'delete_vpc_peering_connections', mocked_delete_vpc_peering_connections)
     monkeypatch.setattr(EC2, 'delete_network_acls', mocked_delete_network_acls)
     monkeypatch.setattr(EC2, 'delete_vpc_subnets', mocked_delete_vpc_subnets)
-    ec2_patch.delete_vpc('region', MockedVpc('vpcId'), 'vpcId')
-
-    assert delete_vpc_calls_stack == ['delete_routing_tables', 'delete_security_groups', 'delete_network_acls',
-                                      'delete_vpc_subnets', 'delete_internet_gw', 'delete_vpc_endpoints',
-                                      'delete_vpc_peering_connections', 'boto3_delete_vpc']
+    ec2_patch.delete_vpc('region', 'vpcId')
+
+    # order within one stage is not deterministic because its calls run in parallel
+    assert set(delete_vpc_calls_stack[:3]) == {'delete_routing_tables', 'delete_vpc_endpoints', 'delete_vpc_peering_connections'}
+    assert delete_vpc_calls_stack[3] == 'delete_vpc_subnets'
+    assert set(delete_vpc_calls_stack[4:7]) == {'delete_security_groups', 'delete_network_acls', 'delete_internet_gw'}
+    assert delete_vpc_calls_stack[7:] == ['boto3_delete_vpc']
+
+
+def test_delete_vpc_resource_per_thread(ec2_patch, monkeypatch):
+    created_in = {}
+    used_in = []
+    stage_threads = set()
+
+    def mocked_vpc(self, region, vpc_id):
+        vpc = MockedVpc(vpc_id)
+        created_in[id(vpc)] = threading.current_thread()
+        return vpc
+
+    def mocked_stage(self, vpc):
+        used_in.append(created_in[id(vpc)] is threading.current_thread())
+        stage_threads.add(threading.current_thread())
+
+    monkeypatch.setattr(EC2, 'vpc', mocked_vpc)
+    for stage in ('delete_vpc_subnets', 'delete_security_groups', 'delete_network_acls', 'delete_internet_gw'):
+        monkeypatch.setattr(EC2, stage, mocked_stage)
+    for stage in ('delete_routing_tables', 'delete_vpc_endpoints', 'delete_vpc_peering_connections'):
+        monkeypatch.setattr(EC2, stage, lambda self, region, vpc_id: None)
+    assert ec2_patch.delete_vpc('region', 'vpcId') is None
+    with ThreadPoolExecutor(max_workers=3) as stages:
+        assert ec2_patch.delete_vpc('region', 'vpcId', stages) is None
+        assert ec2_patch.delete_vpc('region', 'vpcId2', stages) is None
+    # stages run only on threads of given executor, which are reused by following VPCs
+    assert stage_threads - {threading.current_thread()} <= set(stages._threads)
+    # every Vpc resource is used only by the thread which created it
+    assert used_in == [True] * 12
 
 
 def test_delete_vpc_return_exception_str(ec2_patch_for_vpc, monkeypatch):
@@ -403,7 +508,7 @@ def test_delete_vpc_return_exception_str(ec2_patch_for_vpc, monkeypatch):
         raise Exception
 
     monkeypatch.setattr(EC2, 'delete_routing_tables', mocked_dont_call_it)
-    ret = ec2_patch_for_vpc.delete_vpc('region', MockedVpc('vpcId'), 'vpcId')
+    ret = ec2_patch_for_vpc.delete_vpc('region', 'vpcId')
     assert '[vpcId] Exception on VPC deletion. Traceback (most recent call last)' in ret
 
 
@@ -420,6 +525,39 @@ def test_delete_vpc_no_delete_due_notify_only_config(ec2_patch_for_vpc, monkeypa
     assert '[Openqa-Cloud-Watch] 1 VPC\'s should be deleted, skipping due vpc-notify-only=True' in MockedSMTP.mimetext
 
 
+def test_cleanup_vpcs_skips_busy_vpcs(ec2_patch_for_vpc, monkeypatch):
+    deleted = []
+    MockedEC2Client.paginate_calls = list()
+    MockedEC2Client.response = {
+        'Vpcs': [{'VpcId': 'busy', 'OwnerId': 'owner'}, {'VpcId': 'empty', 'OwnerId': 'owner'}],
+        'Reservations': [{'Instances': [{'InstanceId': 'i-1', 'VpcId': 'busy'}]}],
+    }
+    monkeypatch.setattr(EC2, 'delete_vpc', lambda self, region, vpc_id, stages: deleted.append(vpc_id))
+    ec2_patch_for_vpc.cleanup_vpcs()
+    assert deleted == ['empty']
+    assert len(MockedEC2Client.paginate_calls) == 1
+    assert MockedEC2Client.paginate_calls[0][1]['Filters'][0] == {'Name': 'vpc-id', 'Values': ['busy', 'empty']}
+
+
+def test_cleanup_vpcs_in_parallel(ec2_patch_for_vpc, monkeypatch):
+    MockedEC2Client.response = {
+        'Vpcs': [{'VpcId': 'vpc1', 'OwnerId': 'owner'}, {'VpcId': 'vpc2', 'OwnerId': 'owner'}],
+        'Reservations': [],
+    }
+    barrier = threading.Barrier(2, timeout=5)
+    reported = []
+
+    def mocked_delete_vpc(self, region, vpc_id, stages):
+        # both deletions need to be running at the same time to pass the barrier
+        barrier.wait()
+        return f'[{vpc_id}] failed' if vpc_id == 'vpc2' else None
+
+    monkeypatch.setattr(EC2, 'delete_vpc', mocked_delete_vpc)
+    monkeypatch.setattr(EC2, 'report_cleanup_results', lambda self, errors, notify: reported.append((errors, notify)))
+    ec2_patch_for_vpc.cleanup_vpcs()
+    assert reported == [(['[vpc2] failed'], [])]
+
+
 def test_delete_internet_gw(ec2_patch):
     ec2_patch.dry_run = True
     ec2_patch.delete_internet_gw(MockedVpc('vpcId'))
@@ -522,9 +660,75 @@ def test_cleanup_all_calling_all(ec2_patch, monkeypatch):
 
 
 def test_count_all_instances(ec2_patch):
+    MockedEC2Client.response = {'Reservations': [{'Instances': [
+        {'InstanceId': 'i-1', 'LaunchTime': now_age_date, 'InstanceType': 't2.micro', 'State': {'Name': 'running'}}
+    ]}]}
     assert ec2_patch.count_all_instances() == 1
 
 
+def test_list_instances(ec2_patch):
+    MockedEC2Client.paginate_calls = list()
+    MockedEC2Client.response = {'Reservations': [{'Instances': [
+        {'InstanceId': 'i-1', 'LaunchTime': now_age_date, 'InstanceType': 't2.micro', 'State': {'Code': 16, 'Name': 'running'},
+         'Tags': [{'Key': 'openqa_ttl', 'Value': '3600'}], 'PrivateIpAddress': '10.0.0.1'},
+        {'InstanceId': 'i-2', 'LaunchTime': now_age_date, 'InstanceType': 't2.micro', 'State': {'Code': 0, 'Name': 'pending'}},
+    ]}]}
+    assert ec2_patch.list_instances('region1') == [
+        {'InstanceId': 'i-1', 'LaunchTime': now_age_date, 'InstanceType': 't2.micro',
+         'Tags': [{'Key': 'openqa_ttl', 'Value': '3600'}], 'State': 'running'},
+        {'InstanceId': 'i-2', 'LaunchTime': now_age_date, 'InstanceType': 't2.micro', 'Tags': [], 'State': 'pending'},
+    ]
+    assert MockedEC2Client.paginate_calls == [('describe_instances', {})]
+
+
+def test_list_all_instances(ec2_patch, monkeypatch):
+    monkeypatch.setattr(EC2, 'all_regions', ['region1', 'region2'])
+    monkeypatch.setattr(PCWConfig, 'get_feature_property', lambda *args, **kwargs: 2)
+    # every region blocks until both are queried concurrently
+    barrier = threading.Barrier(2, timeout=5)
+
+    def mocked_list_instances(self, region):
+        barrier.wait()
+        return [f'{region}-instance1', f'{region}-instance2']
+
+    monkeypatch.setattr(EC2, 'list_instances', mocked_list_instances)
+    assert list(ec2_patch.list_all_instances()) == [
+        ('region1', 'region1-instance1'), ('region1', 'region1-instance2'),
+        ('region2', 'region2-instance1'), ('region2', 'region2-instance2')
+    ]
+
+
+def test_list_all_instances_hung_region_timeout(ec2_patch, monkeypatch):
+    monkeypatch.setattr(EC2, 'all_regions', ['region1', 'hung'])
+    monkeypatch.setattr(PCWConfig, 'get_feature_property', lambda *args, **kwargs: 1)
+    hung = threading.Event()
+
+    def mocked_list_instances(self, region):
+        if region == 'hung':
+            hung.wait(5)
+        return ['instance']
+
+    monkeypatch.setattr(EC2, 'list_instances', mocked_list_instances)
+    with pytest.raises(TimeoutError, match='hung'):
+        list(ec2_patch.list_all_instances())
+    hung.set()
+
+
+def test_list_all_instances_overall_deadline(ec2_patch, monkeypatch):
+    monkeypatch.setattr(EC2, 'all_regions', ['region1', 'region2', 'region3'])
+    # single worker and timeout of 1 second for whole listing
+    monkeypatch.setattr(PCWConfig, 'get_feature_property', lambda *args, **kwargs: 1)
+
+    def mocked_list_instances(self, region):
+        time.sleep(0.6)
+        return ['instance']
+
+    monkeypatch.setattr(EC2, 'list_instances', mocked_list_instances)
+    # every region alone is within timeout but together they are not
+    with pytest.raises(TimeoutError, match='region2'):
+        list(ec2_patch.list_all_instances())
+
+
 def test_count_all_images(ec2_patch):
     MockedEC2Client.response = {
         'Images': [
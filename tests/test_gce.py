@@ -1,8 +1,11 @@
 import httplib2
+import googleapiclient
 from googleapiclient.errors import HttpError
 from pytest import fixture, mark, raises
 from unittest.mock import MagicMock, patch
 import json
+import re
+from pathlib import Path
 from datetime import datetime, timezone, timedelta
 from ocw.lib.gce import GCE
 from webui.PCWConfig import PCWConfig
@@ -29,14 +32,33 @@ class MockResource:
         self.deleted_resources = list()
         self.responses = responses
         self.error_reason = None
+        self.get_calls = 0
+        self.list_kwargs = None
+        self.item_fields = None
 
     def __call__(self, *args, **kwargs):
         return self
 
     def list(self, *args, **kwargs):
-        return self.responses.pop(0)
+        self.list_kwargs = kwargs
+        if "fields" in kwargs:
+            self.item_fields = re.fullmatch(r"nextPageToken,items\((.*)\)", kwargs["fields"]).group(1).split(",")
+        return self._partial(self.responses.pop(0))
 
     def list_next(self, *args, **kwargs):
+        return self._partial(self.responses.pop(0))
+
+    def _partial(self, request):
+        """ Drop item fields which were not requested like partial response of real API does """
+        if self.item_fields is None or request is None or "items" not in request.response:
+            return request
+        items = [{k: v for k, v in item.items() if k in self.item_fields} for item in request.response["items"]]
+        return MockRequest({**request.response, "items": items}, request.error_reason)
+
+    def aggregatedList(self, *args, **kwargs):
+        return self.responses.pop(0)
+
+    def aggregatedList_next(self, *args, **kwargs):
         return self.responses.pop(0)
 
     def delete(self, *args, **kwargs):
@@ -55,10 +77,31 @@ class MockResource:
         raise ValueError("Unexpected delete request")
 
     def get(self, *args, **kwargs):
+        self.get_calls += 1
         return MockRequest()
 
 
+class MockBatch:
+    executed = 0
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        MockBatch.executed += 1
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except HttpError as exc:
+                self.callback(request_id, None, exc)
+
+
 class MockClient:
+    def new_batch_http_request(self, callback): return MockBatch(callback)
     def objects(self): pass
     def disks(self): pass
     def firewalls(self): pass
@@ -130,6 +173,7 @@ def test_delete_instance(gce):
     gce.compute_client.instances = instances
     gce.delete_instance("instance1", "zone1")
     assert instances.deleted_resources == ["instance1"]
+    assert instances.get_calls == 1
 
 
 def test_list_instances(gce):
@@ -137,6 +181,26 @@ def test_list_instances(gce):
 
 
 def test_list_all_instances(gce):
+    gce.compute_client.instances = MockResource([
+        MockRequest({'items': {
+            'zones/zone1': {'instances': ['instance1', 'instance2']},
+            'zones/zone2': {'warning': {'code': 'NO_RESULTS_ON_PAGE'}},
+        }}),
+        MockRequest({'items': {'zones/zone3': {'instances': ['instance3']}}, 'unreachables': ['zones/zone4']}),
+        None,
+        # on instances().list() for unreachable zone
+        MockRequest({'items': ['instance4']}),
+        None,
+    ])
+    assert gce.list_all_instances() == ["instance1", "instance2", "instance3", "instance4"]
+
+
+def test_list_all_instances_fallback(gce):
+    gce.compute_client.instances = MockResource([
+        MockRequest(error_reason='forbidden'),
+        MockRequest({'items': ['instance1', 'instance2']}),
+        None,
+    ])
     with (
         patch.object(gce, "list_regions", return_value=["region1"]),
         patch.object(gce, "list_zones", return_value=["zone1"]),
@@ -144,25 +208,54 @@ def test_list_all_instances(gce):
         assert gce.list_all_instances() == ["instance1", "instance2"]
 
 
+def test_iter_paginated(gce):
+    disks = MockResource([
+        MockRequest({'items': [{'name': 'disk1'}]}),
+        MockRequest({'items': [{'name': 'disk2'}]}),
+        None,
+    ])
+    items = gce._iter_paginated(disks, fields="name", project="project", zone="zone1")
+    assert next(items) == {'name': 'disk1'}
+    # second page is requested only when first one is consumed
+    assert len(disks.responses) == 2
+    assert disks.list_kwargs == {'project': 'project', 'zone': 'zone1', 'fields': 'nextPageToken,items(name)'}
+    assert list(items) == [{'name': 'disk2'}]
+
+
 def test_list_regions(gce):
     gce.compute_client.regions = MockResource([MockRequest({'items': [{'name': 'Wonderland'}]}), None])
     assert gce.list_regions() == ['Wonderland']
 
 
 def test_list_zones(gce):
-    gce.compute_client.regions = MockResource({'zones': ['somethingthatIdonotknow/RabbitHole']})
-    gce.compute_client.list_zones = {'zones': ['somethingthatIdonotknow/RabbitHole']}
-
-    mock_region_response = {
-        'zones': ['somethingthatIdonotknow/RabbitHole']
-    }
-
-    # Mock the regions().get() method to return the mock response
-    with patch.object(gce.compute_client.regions(), 'get', return_value=MockRequest(mock_region_response)):
-        assert gce.list_zones('Oxfordshire') == ['RabbitHole']
+    gce.compute_client.regions = MockResource([MockRequest({'items': [
+        {'name': 'Oxfordshire', 'zones': ['somethingthatIdonotknow/RabbitHole']}
+    ]}), None])
+    assert gce.list_zones('Oxfordshire') == ['RabbitHole']
+    assert gce.list_zones('Narnia') == []
+
+
+def test_topology_is_cached(gce):
+    regions = MockResource([MockRequest({'items': [{'name': 'region1', 'zones': ['zones/zone1']}]}), None])
+    gce.compute_client.regions = regions
+    assert gce.topology() == {'region1': ['zone1']}
+    # second call would fail on empty responses list if it would hit the API
+    assert gce.list_regions() == ['region1']
+    assert gce.list_zones('region1') == ['zone1']
+
+
+def test_topology_invalidated_on_not_found(gce):
+    gce.compute_client.regions = MockResource([
+        MockRequest({'items': [{'name': 'region1', 'zones': ['zones/zone1']}]}), None,
+        MockRequest({'items': [{'name': 'region2', 'zones': ['zones/zone2']}]}), None,
+    ])
+    gce.compute_client.disks = MockResource([MockRequest(error_reason='notFound')])
+    assert gce.list_zones('region1') == ['zone1']
+    assert gce._paginated(gce.compute_client.disks, project='project', zone='zone1') == []
+    assert gce.topology() == {'region2': ['zone2']}
 
 
-def _test_cleanup(gce, resource_type, cleanup_call, resources):
+def _test_cleanup(gce, resource_type, cleanup_call, resources, labels=True):
 
     with (
         patch.object(gce, 'list_regions', return_value=['region1']),
@@ -171,18 +264,19 @@ def _test_cleanup(gce, resource_type, cleanup_call, resources):
         setattr(gce.compute_client, resource_type, resources)
         setattr(gce.storage_client, resource_type, resources)
         cleanup_call()
+        # labels are taken from list response so no extra get request is needed
+        assert resources.get_calls == 0
         if gce.dry_run:
             assert resources.deleted_resources == []
-        elif resources.get("labels") == "pcw_ignore":
-            assert resources.deleted_resources == ['delete1', 'delete2']
         else:
-            assert resources.deleted_resources == ['delete1', 'delete2', 'pcw_ignore']
+            # API has no labels for some resource types so pcw_ignore label can't be set on them
+            assert resources.deleted_resources == ['delete1', 'delete2'] + ([] if labels else ['pcw_ignore'])
 
 
 @mark.parametrize("dry_run", [True, False])
 def test_cleanup_blobs(gce, mocked_resource, dry_run):
     gce.dry_run = dry_run
-    _test_cleanup(gce, "objects", gce.cleanup_blobs, mocked_resource)
+    _test_cleanup(gce, "objects", gce.cleanup_blobs, mocked_resource, labels=False)
 
 
 @mark.parametrize("dry_run", [True, False])
@@ -200,13 +294,13 @@ def test_cleanup_images(gce, mocked_resource, dry_run):
 @mark.parametrize("dry_run", [True, False])
 def test_cleanup_instance_groups(gce, mocked_resource, dry_run):
     gce.dry_run = dry_run
-    _test_cleanup(gce, "instanceGroups", gce.cleanup_instance_groups, mocked_resource)
+    _test_cleanup(gce, "instanceGroups", gce.cleanup_instance_groups, mocked_resource, labels=False)
 
 
 @mark.parametrize("dry_run", [True, False])
 def test_cleanup_firewalls(gce, mocked_resource, dry_run):
     gce.dry_run = dry_run
-    _test_cleanup(gce, "firewalls", gce.cleanup_firewalls, mocked_resource)
+    _test_cleanup(gce, "firewalls", gce.cleanup_firewalls, mocked_resource, labels=False)
 
 
 @mark.parametrize("dry_run", [True, False])
@@ -218,13 +312,39 @@ def test_cleanup_forwarding_rules(gce, mocked_resource, dry_run):
 @mark.parametrize("dry_run", [True, False])
 def test_cleanup_routes(gce, mocked_resource, dry_run):
     gce.dry_run = dry_run
-    _test_cleanup(gce, "routes", gce.cleanup_routes, mocked_resource)
+    _test_cleanup(gce, "routes", gce.cleanup_routes, mocked_resource, labels=False)
 
 
 @mark.parametrize("dry_run", [True, False])
 def test_cleanup_region_backend_services(gce, mocked_resource, dry_run):
     gce.dry_run = dry_run
-    _test_cleanup(gce, "regionBackendServices", gce.cleanup_region_backend_services, mocked_resource)
+    _test_cleanup(gce, "regionBackendServices", gce.cleanup_region_backend_services, mocked_resource, labels=False)
+
+
+def test_cleanup_images_batched(gce_dry_run_false, mocked_resource):
+    MockBatch.executed = 0
+    gce_dry_run_false.compute_client.images = mocked_resource
+    gce_dry_run_false.cleanup_images()
+    assert mocked_resource.deleted_resources == ['delete1', 'delete2']
+    assert MockBatch.executed == 1
+
+
+def test_cleanup_images_batch_limit(gce_dry_run_false, mocked_resource):
+    MockBatch.executed = 0
+    gce_dry_run_false.compute_client.images = mocked_resource
+    with patch.object(GCE, 'COMPUTE_BATCH_LIMIT', 1):
+        gce_dry_run_false.cleanup_images()
+    assert mocked_resource.deleted_resources == ['delete1', 'delete2']
+    assert MockBatch.executed == 2
+
+
+def test_cleanup_blobs_dry_run_no_batch(gce, mocked_resource):
+    MockBatch.executed = 0
+    gce.dry_run = True
+    gce.storage_client.objects = mocked_resource
+    gce.cleanup_blobs()
+    assert mocked_resource.deleted_resources == []
+    assert MockBatch.executed == 0
 
 
 def test_cleanup_routes_delete_default_route_raise_exception(gce_dry_run_false, mocked_resource):
@@ -250,13 +370,13 @@ def test_cleanup_instance_groups_delete_managed_group_not_raise_exception(gce_dr
 @mark.parametrize("dry_run", [True, False])
 def test_cleanup_subnetworks(gce, mocked_resource, dry_run):
     gce.dry_run = dry_run
-    _test_cleanup(gce, "subnetworks", gce.cleanup_subnetworks, mocked_resource)
+    _test_cleanup(gce, "subnetworks", gce.cleanup_subnetworks, mocked_resource, labels=False)
 
 
 @mark.parametrize("dry_run", [True, False])
 def test_cleanup_networks(gce, mocked_resource, dry_run):
     gce.dry_run = dry_run
-    _test_cleanup(gce, "networks", gce.cleanup_networks, mocked_resource)
+    _test_cleanup(gce, "networks", gce.cleanup_networks, mocked_resource, labels=False)
 
 
 @mark.parametrize("dry_run", [True, False])
@@ -265,6 +385,34 @@ def test_pcw_ignore_label(gce, mocked_resource, dry_run):
     _test_cleanup(gce, "images", gce.cleanup_images, mocked_resource)
 
 
+def test_list_outdated_fields(gce):
+    """ Every projection must be valid for the resource schema and include labels when resource has them """
+    documents = Path(googleapiclient.__file__).parent / "discovery_cache" / "documents"
+    schemas = {
+        "blob": json.loads((documents / "storage.v1.json").read_text())["schemas"]["Object"],
+        **{resource_type: json.loads((documents / "compute.v1.json").read_text())["schemas"][schema] for resource_type, schema in {
+            "disk": "Disk", "image": "Image", "firewall": "Firewall", "forwardingRule": "ForwardingRule",
+            "instanceGroup": "InstanceGroup", "regionBackendService": "BackendService", "route": "Route",
+            "subnetwork": "Subnetwork", "network": "Network"}.items()},
+    }
+    projections = {}
+    with (
+        patch.object(gce, '_list_outdated', side_effect=lambda api_call, resource_type, fields, **kwargs:
+                     projections.setdefault(resource_type, fields) and []),
+        patch.object(gce, 'list_regions', return_value=['region1']),
+        patch.object(gce, 'list_zones', return_value=['zone1']),
+    ):
+        for cleanup_call in (gce.cleanup_blobs, gce.cleanup_disks, gce.cleanup_images, gce.cleanup_firewalls,
+                             gce.cleanup_forwarding_rules, gce.cleanup_instance_groups, gce.cleanup_region_backend_services,
+                             gce.cleanup_routes, gce.cleanup_subnetworks, gce.cleanup_networks):
+            cleanup_call()
+    assert set(projections) == set(schemas)
+    for resource_type, fields in projections.items():
+        properties = schemas[resource_type]["properties"]
+        assert set(fields.split(",")) <= set(properties), resource_type
+        assert ("labels" in fields.split(",")) == ("labels" in properties), resource_type
+
+
 def test_cleanup_all(gce):
     gce.cleanup_blobs = MagicMock()
     gce.cleanup_disks = MagicMock()
@@ -288,6 +436,43 @@ def test_cleanup_all(gce):
     gce.cleanup_subnetworks.assert_called_once()
 
 
+def test_cleanup_all_respects_dependencies(gce):
+    finished = []
+
+    def cleanup(name):
+        def call():
+            for dependency in GCE.CLEANUP_DEPENDENCIES[name]:
+                assert dependency in finished, f"{name} started before {dependency}"
+            finished.append(name)
+        return call
+
+    for name in GCE.CLEANUP_DEPENDENCIES:
+        setattr(gce, name, cleanup(name))
+    try:
+        gce.cleanup_all()
+    finally:
+        for name in GCE.CLEANUP_DEPENDENCIES:
+            delattr(gce, name)
+    assert set(finished) >= set(GCE.CLEANUP_DEPENDENCIES) - {"cleanup_blobs"}
+
+
+def test_cleanup_all_failure_skips_dependent(gce):
+    mocks = {name: MagicMock() for name in GCE.CLEANUP_DEPENDENCIES}
+    mocks["cleanup_subnetworks"].side_effect = ValueError("subnetworks")
+    for name, mock in mocks.items():
+        setattr(gce, name, mock)
+    try:
+        with raises(ValueError, match="subnetworks"):
+            gce.cleanup_all()
+    finally:
+        for name in GCE.CLEANUP_DEPENDENCIES:
+            delattr(gce, name)
+    mocks["cleanup_networks"].assert_not_called()
+    mocks["cleanup_routes"].assert_called_once()
+    mocks["cleanup_disks"].assert_called_once()
+    mocks["cleanup_images"].assert_called_once()
+
+
 def test_get_error_reason():
 
     class MockHttpError:
@@ -303,15 +488,14 @@ def test_get_error_reason():
 
 
 def test_count_all_instances(gce):
-    with (
-        patch.object(gce, 'list_regions', return_value=['region1']),
-        patch.object(gce, 'list_zones', return_value=['zone1']),
-    ):
-        assert gce.count_all_instances() == 2
+    gce.compute_client.instances = MockResource([
+        MockRequest({'items': {'zones/zone1': {'instances': ['instance1', 'instance2']}}}), None
+    ])
+    assert gce.count_all_instances() == 2
 
 
 def test_count_all_images(gce):
-    with (patch.object(gce, '_paginated', return_value=[1, 2, 3, 4])):
+    with (patch.object(gce, '_iter_paginated', return_value=iter([1, 2, 3, 4]))):
         assert gce.count_all_images() == 4
 
 
@@ -319,16 +503,16 @@ def test_count_all_disks(gce):
     with (
         patch.object(gce, 'list_regions', return_value=['region1']),
         patch.object(gce, 'list_zones', return_value=['zone1']),
-        patch.object(gce, '_paginated', return_value=[1, 2, 3, 4]),
+        patch.object(gce, '_iter_paginated', return_value=iter([1, 2, 3, 4])),
     ):
         assert gce.count_all_disks() == 4
 
 
 def test_count_all_blobs(gce):
-    with (patch.object(gce, '_paginated', return_value=[1, 2, 3, 4])):
+    with (patch.object(gce, '_iter_paginated', return_value=iter([1, 2, 3, 4]))):
         assert gce.count_all_blobs() == 4
 
 
 def test_count_all_networks(gce):
-    with (patch.object(gce, '_paginated', return_value=[1, 2, 3, 4])):
+    with (patch.object(gce, '_iter_paginated', return_value=iter([1, 2, 3, 4]))):
         assert gce.count_all_networks() == 4
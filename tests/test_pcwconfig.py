@@ -10,6 +10,7 @@ def test_get_feature_property_with_defaults(pcw_file):
     assert PCWConfig.get_feature_property('cleanup', 'max-age-hours', 'fake') == 24 * 7
     assert PCWConfig.get_feature_property('cleanup', 'ec2-max-age-days', 'fake') == -1
     assert PCWConfig.get_feature_property('updaterun', 'default_ttl', 'fake') == 44400
+    assert PCWConfig.get_feature_property('updaterun', 'max_workers', 'fake') == 4
     assert PCWConfig.get_feature_property('cleanup', 'azure-storage-resourcegroup', 'fake') == 'openqa-upload'
     assert type(PCWConfig.get_feature_property('cleanup', 'azure-storage-resourcegroup', 'fake')) is str
 
@@ -4,6 +4,8 @@ from datetime import timezone
 from datetime import timedelta
 from webui.PCWConfig import PCWConfig
 from .generators import mock_get_feature_property
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 
 
@@ -39,3 +41,44 @@ def test_exec_cmd(provider_patch):
 
     out = provider.cmd_exec("ls /invalid_dir")
     assert out.returncode != 0
+
+
+def test_cached(provider_patch):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return len(calls)
+
+    provider = Provider('testcached')
+    assert provider.cached('value', loader, 3600) == 1
+    assert Provider('testcached').cached('value', loader, 3600) == 1
+    assert Provider('othernamespace').cached('value', loader, 3600) == 2
+    assert provider.cached('value', loader, -1) == 3
+    provider.invalidate_cached('value')
+    assert provider.cached('value', loader, 3600) == 4
+    Provider.clear_cache()
+    assert provider.cached('value', loader, 3600) == 5
+
+
+def test_cached_concurrent(provider_patch):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.2)
+        return len(calls)
+
+    provider = Provider('testcachedconcurrent')
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: provider.cached('value', loader, 3600), range(4)))
+    assert results == [1, 1, 1, 1]
+    assert len(calls) == 1
+    Provider.clear_cache()
+
+
+def test_ensure_credentials(provider_patch):
+    checks = []
+    Provider('testcredentials').ensure_credentials(lambda: checks.append(1))
+    Provider('testcredentials').ensure_credentials(lambda: checks.append(1))
+    assert len(checks) == 1
@@ -55,14 +55,35 @@ class PCWConfig():
     @staticmethod
     def get_feature_property(feature: str, feature_property: str, namespace: str | None = None) -> str | int:
         default_values: dict[str, dict[str, int | type[int] | str | type[str] | type[str] | None]] = {
+            'default/credentials_ttl': {'default': 3600, 'return_type': int},
+            'default/regions_ttl': {'default': 24 * 3600, 'return_type': int},
+            'default/ec2_max_workers': {'default': 8, 'return_type': int},
+            'default/ec2_list_timeout': {'default': 300, 'return_type': int},
+            'default/aws_max_pool_connections': {'default': 20, 'return_type': int},
+            'default/aws_retry_mode': {'default': 'adaptive', 'return_type': str},
+            'default/aws_max_attempts': {'default': 10, 'return_type': int},
+            'default/aws_connect_timeout': {'default': 10, 'return_type': int},
+            'default/aws_read_timeout': {'default': 60, 'return_type': int},
+            'default/azure_max_inflight_deletes': {'default': 20, 'return_type': int},
+            'default/azure_lro_poll_interval': {'default': 10, 'return_type': int},
+            'default/azure_lro_wait_timeout': {'default': 600, 'return_type': int},
+            'default/azure_max_pool_connections': {'default': 20, 'return_type': int},
+            'default/azure_connect_timeout': {'default': 10, 'return_type': int},
+            'default/azure_read_timeout': {'default': 60, 'return_type': int},
+            'default/azure_resource_group_filter': {'default': None, 'return_type': str},
             'cleanup/azure-gallery-name': {'default': 'test_image_gallery', 'return_type': str},
             'cleanup/azure-storage-resourcegroup': {'default': 'openqa-upload', 'return_type': str},
             'cleanup/azure-storage-account-name': {'default': 'openqa', 'return_type': str},
+            'cleanup/azure-blob-max-workers': {'default': 4, 'return_type': int},
+            'cleanup/azure-gallery-max-workers': {'default': 4, 'return_type': int},
             'cleanup/ec2-max-age-days': {'default': -1, 'return_type': int},
             'cleanup/gce-bucket': {'default': None, 'return_type': str},
+            'cleanup/gce-max-workers': {'default': 4, 'return_type': int},
             'cleanup/max-age-hours': {'default': 24 * 7, 'return_type': int},
+            'cleanup/vpc-max-workers': {'default': 4, 'return_type': int},
             'updaterun/default_ttl': {'default': 44400, 'return_type': int},
             'updaterun/reset_deleting_after': {'default': 2 * 44400, 'return_type': int},
+            'updaterun/max_workers': {'default': 4, 'return_type': int},
             'notify/to': {'default': None, 'return_type': str},
             'notify/age-hours': {'default': 12, 'return_type': int},
             'notify/smtp': {'default': None, 'return_type': str},